@@ -1,5 +1,8 @@
+import json
+import os
 import streamlit as st
-from datetime import date
+import html
+from datetime import date, timedelta
 from tools.patient_db import PatientDB
 from tools.schedule_excel import ScheduleExcel
 from tools.messaging import Messaging
@@ -15,17 +18,87 @@ SCHEDULE_XLSX = "data/schedules.xlsx"
 INTAKE_PDF = "data/intake_form.pdf"
 APPT_EXPORT = "data/appointments_export.xlsx"
 LOG_FILE = "data/messaging.log"
-
-patient_db = PatientDB(PATIENT_CSV)
-schedule_tool = ScheduleExcel(SCHEDULE_XLSX)
-messaging = Messaging(log_path=LOG_FILE)
-exporter = Exporter(APPT_EXPORT)
-form_sender = FormSender(INTAKE_PDF)
-
-# keep orchestrator persistent in Streamlit session
-if "orch" not in st.session_state:
-    st.session_state["orch"] = Orchestrator(patient_db, schedule_tool, messaging, exporter, form_sender)
-orch = st.session_state["orch"]
+LOG_PAGE_SIZE = 50
+ANY_DOCTOR = "Any doctor (earliest available)"
+ANY_LOCATION = "Any location"
+ANY_DOCTOR_SLOTS = 20   # earliest slots listed for an any-doctor search
+# STORAGE_BACKEND=sqlite keeps patients, slots and appointments in one SQLite database;
+# the CSV/XLSX files are imported into it on first start
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "files")
+SQLITE_DB = os.environ.get("SQLITE_DB", "data/scheduler.db")
+
+@st.cache_resource(show_spinner="Loading patients and schedules...")
+def load_data():
+    """
+    Patient and schedule tools shared by every session of this server process: the data
+    files are read once, not on every rerun. reload_data() reads them again.
+    """
+    storage = None
+    if STORAGE_BACKEND == "sqlite":
+        from tools.sqlite_store import SQLiteStore, SQLitePatientDB, SQLiteSchedule
+        storage = SQLiteStore(SQLITE_DB)
+        if storage.is_empty():
+            storage.import_patients_csv(PATIENT_CSV)
+            storage.import_schedules_xlsx(SCHEDULE_XLSX)
+        patient_db = SQLitePatientDB(storage)
+        schedule_tool = SQLiteSchedule(storage)
+    else:
+        patient_db = PatientDB(PATIENT_CSV, journal=True)
+        schedule_tool = ScheduleExcel(SCHEDULE_XLSX)
+    return {"storage": storage, "patient_db": patient_db, "schedule_tool": schedule_tool}
+
+@st.cache_resource
+def load_services():
+    """
+    Messaging, exports, forms and the orchestrator, shared by every session for the life
+    of the process: the orchestrator holds the in-memory appointments, the reminder
+    queue and the export watermark, so it is never rebuilt by a data reload.
+    """
+    data = load_data()
+    # one dispatcher (and worker thread) and one reminder thread for the whole process
+    messaging = Messaging(log_path=LOG_FILE, async_dispatch=True)
+    exporter = Exporter(APPT_EXPORT)
+    form_sender = FormSender(INTAKE_PDF)
+    orch = Orchestrator(data["patient_db"], data["schedule_tool"], messaging, exporter, form_sender, data["storage"])
+    orch.reminders.start()
+    return {"messaging": messaging, "exporter": exporter, "form_sender": form_sender, "orch": orch}
+
+def reload_data():
+    """Invalidation hook: re-read patients and schedules and point the shared orchestrator at them."""
+    load_data.clear()
+    data = load_data()
+    load_services()["orch"].use_data(data["patient_db"], data["schedule_tool"], data["storage"])
+
+def heatmap_html(usage):
+    """Doctor x day utilization table; each cell is one lookup in the pivoted aggregates."""
+    days = sorted(usage["date"].unique())
+    cells = {(r.doctor, r.date): r for r in usage.itertuples(index=False)}
+    head = "".join(f"<th>{d.strftime('%a<br>%m-%d')}</th>" for d in days)
+    body = []
+    for doctor in usage["doctor"].unique():
+        row = []
+        for d in days:
+            r = cells.get((doctor, d))
+            if r is None or r.free_minutes + r.booked_minutes == 0:
+                row.append("<td></td>")
+                continue
+            row.append(f'<td title="{r.booked_minutes}m booked / {r.free_minutes}m free" '
+                       f'style="background: rgba(220, 38, 38, {0.1 + 0.9 * r.utilization:.2f})">'
+                       f"{r.utilization:.0%}</td>")
+        body.append(f"<tr><th>{html.escape(doctor)}</th>{''.join(row)}</tr>")
+    return (f'<table class="heatmap"><tr><th></th>{head}</tr>{"".join(body)}</table>'
+            "<style>.heatmap{font-size:0.75rem;border-collapse:collapse}"
+            ".heatmap td,.heatmap th{padding:2px 4px;text-align:center;border:1px solid #e2e8f0}</style>")
+
+data = load_data()
+services = load_services()
+storage = data["storage"]
+patient_db = data["patient_db"]
+schedule_tool = data["schedule_tool"]
+messaging = services["messaging"]
+exporter = services["exporter"]
+form_sender = services["form_sender"]
+orch = services["orch"]
 
 # Extra UI polish
 st.markdown("""
@@ -119,18 +192,58 @@ st.markdown('<p class="main-header">AI Scheduling Agent</p>', unsafe_allow_html=
 with st.sidebar:
     st.markdown("### Admin Panel")
     st.markdown("---")
+    if st.button("Reload Data Files", use_container_width=True,
+                 help="Re-read patients and schedules for every session (e.g. after editing the files); appointments are kept"):
+        reload_data()
+        st.rerun()
     if st.button("Export Appointments", use_container_width=True):
         orch.export_appointments()
         st.success(f"Exported to {APPT_EXPORT}")
+    delta_fmt = st.selectbox("Incremental export format", ["xlsx", "csv", "parquet"], key="delta_fmt")
+    if st.button("Export Changes Since Last Export", use_container_width=True):
+        try:
+            delta_path = orch.export_appointments(incremental=True, fmt=delta_fmt)
+        except ImportError:
+            st.error("Parquet export needs pyarrow installed.")
+        else:
+            if delta_path:
+                st.success(f"Exported changes to {delta_path}")
+            else:
+                st.info("No appointment changes since the last export.")
     if st.button("Run Reminder Simulation", use_container_width=True):
         orch.trigger_reminders()
         st.success("Reminders checked & sent (if due).")
     st.markdown("---")
+    st.markdown("**Bulk Referrals:**")
+    referrals = st.file_uploader("CSV with name, dob, phone, email, preferred_doctor, reason", type=["csv"])
+    allocation = st.selectbox("Slot allocation", ["first-fit", "most placements (per tier)", "least wait"], key="allocation")
+    if referrals is not None and st.button("Book All Referrals", use_container_width=True):
+        import pandas as pd
+        reqs = pd.read_csv(referrals, dtype=str).fillna("").to_dict("records")
+        objective = {"most placements (per tier)": "placements", "least wait": "wait"}.get(allocation)
+        results = orch.book_many(reqs, objective=objective)
+        booked = sum(r["status"] == "ok" for r in results)
+        if booked:
+            st.session_state["last_appt_id"] = [r for r in results if r["status"] == "ok"][-1]["appt"]["appt_id"]
+        st.success(f"Booked {booked} of {len(results)} referrals.")
+        failed = [{"row": i + 1, "name": reqs[i].get("name", ""), "error": r["message"]}
+                  for i, r in enumerate(results) if r["status"] != "ok"]
+        if failed:
+            st.dataframe(failed)
+    st.markdown("---")
     st.markdown("**Messaging Log:**")
-    if st.button("Show Log", use_container_width=True):
-        try:
-            st.code(open(LOG_FILE).read())
-        except FileNotFoundError:
+    if st.checkbox("Show Log", key="show_log"):
+        messaging.flush()
+        log_appt = st.text_input("Filter by appointment ID", key="log_appt").strip()
+        if log_appt:
+            entries = messaging.log.for_appointment(log_appt)
+        else:
+            pages = max(1, -(-messaging.log.count() // LOG_PAGE_SIZE))
+            log_page = st.number_input("Page (newest first)", min_value=1, max_value=pages, value=1, key="log_page")
+            entries = messaging.log.page(log_page - 1, LOG_PAGE_SIZE)
+        if entries:
+            st.code("\n".join(json.dumps(e) for e in entries))
+        else:
             st.info("No logs yet.")
 
 # Main content
@@ -145,7 +258,12 @@ with col1:
     max_value=date(2025, 12, 31), key="dob")
         phone = st.text_input("Phone number", key="phone")
         email = st.text_input("Email", key="email")
-        doctor = st.selectbox("Preferred doctor", schedule_tool.list_doctors(), key="doctor")
+        # a named doctor is the default: "any doctor" (and the location list) parse every sheet
+        doctor = st.selectbox("Preferred doctor", schedule_tool.list_doctors() + [ANY_DOCTOR], key="doctor")
+        location = None
+        if doctor == ANY_DOCTOR:
+            site = st.selectbox("Location", [ANY_LOCATION] + schedule_tool.list_locations(), key="location")
+            location = None if site == ANY_LOCATION else site
         reason = st.text_area("Reason for visit (short)", key="reason", help="Chief complaint")
 
     with st.container():
@@ -167,11 +285,12 @@ with col1:
     # Only call match when user entered at least one identifying field
     if any([name.strip(), email.strip(), phone.strip()]):
         try:
-            patient_match, status, score = patient_db.match_patient(name.strip(), dob, phone.strip(), email.strip())
+            # one ranking pass gives both the match and the debug candidate list
+            patient_match, status, score, top_candidates = patient_db.match_with_candidates(
+                name.strip(), dob, phone.strip(), email.strip(), top_k=5)
             # DEBUG UI: show matcher result + candidate list (helps debug fuzzy failures)
             try:
                 st.caption(f"DEBUG: matcher -> status={status}, score={score}, matched_id={patient_match.get('patient_id') if patient_match else None}")
-                top_candidates = patient_db.debug_candidates(name.strip(), dob, top_k=5)
                 st.write("DEBUG candidates:", top_candidates)
             except Exception:
                 # If debug helpers are missing or fail, ignore the debug display
@@ -186,8 +305,16 @@ with col1:
 
     st.markdown(f"**Suggestion:** {suggestion_text}")
 
-    # load available slots for chosen doctor/day
-    slots = schedule_tool.available_slots(doctor, selected_day)
+    # load available slots for chosen doctor/day; once the visit length is known, list
+    # slots long enough for it (back-to-back free slots are offered as one). With any
+    # doctor, list the clinic's earliest slots from the chosen day on.
+    if doctor == ANY_DOCTOR:
+        slots = schedule_tool.find_slots_any(predicted_duration or 1, from_date=selected_day,
+                                             limit=ANY_DOCTOR_SLOTS, location=location)
+    elif predicted_duration is not None:
+        slots = schedule_tool.find_slots(doctor, predicted_duration, from_date=selected_day, to_date=selected_day)
+    else:
+        slots = schedule_tool.available_slots(doctor, selected_day)
     slot_choice = None
 
     if not slots:
@@ -204,7 +331,10 @@ with col1:
             # fallback to duration or compute if missing
             if length is None:
                 length = s.get("duration", "")
-            slot_labels.append(f"{date_label} {start} - {end} ({length}m)")
+            label = f"{date_label} {start} - {end} ({length}m)"
+            if s.get("doctor"):
+                label += f" - {s['doctor']}, {s.get('location', '')}"
+            slot_labels.append(label)
 
         # find first slot matching predicted_duration (if we have one)
         suggested_index = None
@@ -244,15 +374,18 @@ with col1:
             dob=dob,
             phone=phone.strip(),
             email=email.strip(),
-            preferred_doctor=doctor,
+            preferred_doctor=None if doctor == ANY_DOCTOR else doctor,
             reason=reason.strip(),
             insurer=insurer.strip(),
             member_id=member_id.strip(),
             group_no=group_no.strip(),
-            slot=slot_choice  # NEW
+            slot=slot_choice,  # NEW
+            location=location
         )
         st.session_state["last_result"] = result
         if result["status"] == "ok":
+            # this session's latest booking, for the manual actions below
+            st.session_state["last_appt_id"] = result["appt"]["appt_id"]
             st.success(result["message"])
         else:
             st.error(result["message"])
@@ -276,31 +409,53 @@ with col2:
     else:
         st.info("No available slots for that day.")
 
+    st.markdown("#### Utilization")
+    # on demand only: the heatmap covers every doctor, so it parses every sheet
+    if st.checkbox("Show utilization heatmap", key="show_heat"):
+        heat_from = st.date_input("From", value=date.today(), key="heat_from")
+        heat_days = st.selectbox("Range", [7, 14, 31], format_func=lambda n: f"{n} days", key="heat_days")
+        usage = schedule_tool.utilization(heat_from, heat_from + timedelta(days=heat_days - 1))
+        if usage.empty:
+            st.info("No schedule in that range.")
+        else:
+            # booked share of the bookable minutes per doctor and day (hover for minutes)
+            st.markdown(heatmap_html(usage), unsafe_allow_html=True)
+
 st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
 st.markdown("#### Manual Actions")
+# the orchestrator is shared by all sessions; act on the appointment this session booked last
+session_appt = orch.get_appointment(st.session_state.get("last_appt_id", ""))
 c1, c2, c3 = st.columns(3)
 with c1:
     if st.button("Send Test Reminder (R1)", use_container_width=True):
-        if orch.appointments_df.empty:
-            st.info("No appointments to remind.")
+        if session_appt is None:
+            st.info("No appointment booked in this session to remind.")
         else:
-            appt = orch.appointments_df.iloc[-1].to_dict()
-            messaging.send_reminder(appt, 1)
-            st.success("Reminder sent (logged).")
+            messaging.send_reminder(session_appt, 1)
+            st.success(f"Reminder sent for {session_appt['appt_id']} (logged).")
 with c2:
     if st.button("Send Intake Form", use_container_width=True):
-        if orch.appointments_df.empty:
-            st.info("No appointments.")
+        if session_appt is None:
+            st.info("No appointment booked in this session.")
         else:
-            appt = orch.appointments_df.iloc[-1].to_dict()
-            form_sender.send_form(appt["patient_email"], appt["appt_id"])
-            st.success("Form send simulated.")
+            form_sender.send_form(session_appt["patient_email"], session_appt["appt_id"])
+            st.success(f"Form send simulated for {session_appt['appt_id']}.")
 with c3:
     if st.button("Show Appointments", use_container_width=True):
         st.dataframe(orch.appointments_df.astype(str))
+with st.expander("Cancel Appointment"):
+    cancel_id = st.text_input("Appointment ID", key="cancel_id").strip()
+    cancel_reason = st.text_input("Cancellation reason", key="cancel_reason").strip()
+    if st.button("Cancel appointment", key="cancel_btn", disabled=not cancel_id):
+        result = orch.cancel_appointment(cancel_id, cancel_reason)
+        if result["status"] == "ok":
+            st.success(result["message"])
+        else:
+            st.error(result["message"])
 
 st.markdown("---")
-st.caption("This MVP uses file-backed CSV/XLSX for storage.")
+st.caption("This MVP uses file-backed CSV/XLSX for storage." if storage is None
+           else f"Storage: SQLite ({SQLITE_DB}).")
 
 
 
@@ -4,59 +4,98 @@ This is a simple deterministic flow (no external LLM required).
 """
 
 from datetime import datetime
+import threading
 import uuid
 import pandas as pd
+from tools.appointment_store import AppointmentStore
+from tools.assignment import assign_slots
+from tools.reminders import ReminderScheduler
+from tools.slot_index import DEFAULT_LOCATION
+
+APPOINTMENT_COLS = [
+    "appt_id","patient_id","patient_name","patient_email","patient_phone",
+    "doctor","location","date","start","end","duration","status",
+    "reason","insurance_carrier","member_id","group_no",
+    "forms_sent_at","forms_completed","reminder1","reminder2","reminder3",
+    "cancel_reason","created_at","exported_at"
+]
 
 class Orchestrator:
-    def __init__(self, patient_db, schedule_tool, messaging, exporter, form_sender):
+    def __init__(self, patient_db, schedule_tool, messaging, exporter, form_sender, storage=None):
         self.patient_db = patient_db
         self.schedule_tool = schedule_tool
         self.messaging = messaging
         self.exporter = exporter
         self.form_sender = form_sender
+        # optional SQLiteStore: appointments are persisted there and reloaded on startup
+        self.storage = storage
 
-        # appointments DataFrame kept in-memory; exporter can write it out
-        cols = [
-            "appt_id","patient_id","patient_name","patient_email","patient_phone",
-            "doctor","location","date","start","end","duration","status",
-            "reason","insurance_carrier","member_id","group_no",
-            "forms_sent_at","forms_completed","reminder1","reminder2","reminder3",
-            "cancel_reason","created_at","exported_at"
-        ]
-        self.appointments_df = pd.DataFrame(columns=cols)
+        # appointments kept in-memory in an append-friendly store; exporter can write it out
+        self.appointments = AppointmentStore(APPOINTMENT_COLS)
+        # guards appointment updates shared with the reminder thread
+        self._lock = threading.RLock()
+        if storage is not None:
+            # rows the store has not seen exported since their last change go in the next
+            # incremental export; the rest count as unchanged
+            pending = storage.pending_exports()
+            for appt in storage.load_appointments():
+                self.appointments.append(appt, track=appt["appt_id"] in pending)
+        # change seq covered by the last export (see export_appointments)
+        self._export_seq = 0
+        # R1/R2/R3 queue; rebuilt from the appointment records so a restart resumes it
+        self.reminders = ReminderScheduler(self._fire_reminder)
+        self.reminders.rebuild(self.appointments)
 
-    def start_booking(self, name, dob, phone, email, preferred_doctor, reason,
-                      insurer="", member_id="", group_no="", slot=None):
-        # 1. Identify patient
-        patient, status, score = self.patient_db.match_patient(name, dob, phone, email)
-        if status == "new":
-            patient = self.patient_db.create_patient(name, dob, phone, email, preferred_doctor)
+    def use_data(self, patient_db, schedule_tool, storage=None):
+        """Switch to freshly loaded patient/schedule tools; appointments and reminders are kept."""
+        with self._lock:
+            self.patient_db = patient_db
+            self.schedule_tool = schedule_tool
+            self.storage = storage
 
-        # 2. Determine duration
-        duration = 60 if status == "new" else 30
+    @property
+    def appointments_df(self):
+        """Appointments as a DataFrame (built on demand, for display and export)."""
+        # the store's column lists grow one at a time; read them whole, under the lock
+        with self._lock:
+            return self.appointments.to_dataframe()
 
-        # 3. Pick slot
-        if slot is None:
-            slots = self.schedule_tool.find_slots(preferred_doctor, duration)
-            if not slots:
-                return {"status": "error", "message": "No available slots found. Try a different doctor or day."}
-            slot = slots[0]  # fallback if UI didn’t pass a slot
+    def get_appointment(self, appt_id):
+        """One appointment record (a copy), or None; safe while other sessions book."""
+        with self._lock:
+            return self.appointments.get(appt_id)
 
-        # 4. Book the slot
-        booked = self.schedule_tool.book_slot(preferred_doctor, slot)
-        if not booked:
-            return {"status": "error", "message": "Failed to book slot due to conflict. Try again."}
+    def _update_appointment(self, appt_id, track=True, **fields):
+        with self._lock:
+            self.appointments.update(appt_id, track=track, **fields)
+            if self.storage is not None:
+                self.storage.update_appointment(appt_id, track=track, **fields)
 
-        # 5. Create appointment record
-        appt_id = f"APPT-{uuid.uuid4().hex[:8]}"
-        appt = {
-            "appt_id": appt_id,
+    def _mark_exported(self, appt_ids, now):
+        # untracked stamp, persisted together with the store's "exported since last change"
+        with self._lock:
+            for appt_id in appt_ids:
+                self.appointments.update(appt_id, track=False, exported_at=now)
+            if self.storage is not None:
+                self.storage.mark_exported(list(appt_ids), now)
+
+    def _fire_reminder(self, appt_id, reminder_no, now):
+        with self._lock:
+            appt = self.appointments.get(appt_id)
+            if appt is None or appt[f"reminder{reminder_no}"] or appt["status"] == "cancelled":
+                return
+            self.messaging.send_reminder(appt, reminder_no)
+            self._update_appointment(appt_id, **{f"reminder{reminder_no}": now.isoformat()})
+
+    def _new_appointment(self, patient, doctor, slot, duration, reason, insurer="", member_id="", group_no=""):
+        return {
+            "appt_id": f"APPT-{uuid.uuid4().hex[:8]}",
             "patient_id": patient["patient_id"],
             "patient_name": patient["name"],
             "patient_email": patient["email"],
             "patient_phone": str(patient["phone"]),  # ensure string for Arrow
-            "doctor": preferred_doctor,
-            "location": "Main Clinic",
+            "doctor": doctor,
+            "location": slot.get("location", DEFAULT_LOCATION),
             "date": slot["date"].isoformat(),
             "start": slot["start_time"],
             "end": slot["end_time"],
@@ -75,50 +114,222 @@ class Orchestrator:
             "created_at": datetime.utcnow().isoformat(),
             "exported_at": ""
         }
-        self.appointments_df = pd.concat([self.appointments_df, pd.DataFrame([appt])], ignore_index=True)
+
+    @staticmethod
+    def _normalize_slot(slot):
+        # book_slot accepts any date-like "date"; the appointment record needs a date
+        return {**slot, "date": pd.Timestamp(slot["date"]).date()}
+
+    def _find_slot(self, doctor, duration, from_date=None, to_date=None, location=None):
+        # first free slot for the doctor; no doctor -> earliest available across the clinic
+        if doctor:
+            slots = self.schedule_tool.find_slots(doctor, duration, from_date=from_date or None, limit=1,
+                                                  to_date=to_date or None)
+        else:
+            slots = self.schedule_tool.find_slots_any(duration, from_date=from_date or None, limit=1,
+                                                      to_date=to_date or None, location=location or None)
+        return slots[0] if slots else None
+
+    def start_booking(self, name, dob, phone, email, preferred_doctor, reason,
+                      insurer="", member_id="", group_no="", slot=None, location=None):
+        """preferred_doctor=None books the earliest slot with any doctor (at `location`, if given)."""
+        # 1. Identify patient
+        patient, status, score = self.patient_db.match_patient(name, dob, phone, email)
+        if status == "new":
+            patient = self.patient_db.create_patient(name, dob, phone, email, preferred_doctor or "")
+
+        # 2. Determine duration
+        duration = 60 if status == "new" else 30
+
+        # 3. Pick slot
+        if slot is None:
+            slot = self._find_slot(preferred_doctor, duration, location=location)  # fallback if UI didn’t pass a slot
+            if slot is None:
+                return {"status": "error", "message": "No available slots found. Try a different doctor or day."}
+        slot = self._normalize_slot(slot)
+        # clinic-wide results name their doctor
+        doctor = preferred_doctor or slot.get("doctor")
+
+        # 4. Build the appointment record, then book the slot (nothing after the claim can fail)
+        appt = self._new_appointment(patient, doctor, slot, duration, reason, insurer, member_id, group_no)
+        booked = self.schedule_tool.book_slot(doctor, slot, patient_id=patient["patient_id"])
+        if not booked:
+            return {"status": "error", "message": "Failed to book slot due to conflict. Try again."}
+
+        # 5. Store the appointment record
+        appt_id = appt["appt_id"]
+        with self._lock:
+            self.appointments.append(appt)
+            if self.storage is not None:
+                self.storage.insert_appointment(appt)
+        self.reminders.schedule(appt)
 
         # 6. Send confirmation
         self.messaging.send_confirmation(appt)
 
         # 7. Send intake form (per requirement only after confirmation)
         self.form_sender.send_form(appt["patient_email"], appt_id)
-        self.appointments_df.loc[self.appointments_df.appt_id == appt_id, "forms_sent_at"] = datetime.utcnow().isoformat()
+        self._update_appointment(appt_id, forms_sent_at=datetime.utcnow().isoformat())
 
         return {
             "status": "ok",
-            "message": f"Booked {preferred_doctor} on {slot['date'].isoformat()} {slot['start_time']}. Appointment ID: {appt_id}",
+            "message": f"Booked {doctor} on {slot['date'].isoformat()} {slot['start_time']}. Appointment ID: {appt_id}",
             "appt": appt
         }
 
-    def export_appointments(self, path="data/appointments_export.xlsx"):
-        self.appointments_df["exported_at"] = datetime.utcnow().isoformat()
-        self.exporter.export(self.appointments_df)
+    def cancel_appointment(self, appt_id, reason=""):
+        """Cancel a booking: release its slot in the schedule (utilization follows) and mark the record cancelled."""
+        with self._lock:
+            appt = self.appointments.get(appt_id)
+            if appt is None:
+                return {"status": "error", "message": f"Unknown appointment {appt_id}."}
+            if appt["status"] == "cancelled":
+                return {"status": "error", "message": f"Appointment {appt_id} is already cancelled."}
+            slot = {"date": appt["date"], "start_time": appt["start"], "end_time": appt["end"]}
+            released = self.schedule_tool.release_slot(appt["doctor"], slot, patient_id=appt["patient_id"])
+            self._update_appointment(appt_id, status="cancelled", cancel_reason=reason)
+        message = f"Cancelled {appt_id}."
+        if not released:
+            message += " Its slot was no longer booked for this patient, so the schedule was left unchanged."
+        return {"status": "ok", "message": message, "appt": self.get_appointment(appt_id)}
+
+    @staticmethod
+    def _referral_key(req):
+        # same person referred twice in one batch -> one new patient record
+        email = str(req.get("email") or "").strip().lower()
+        phone = "".join(ch for ch in str(req.get("phone") or "") if ch.isdigit())
+        return email or phone or (str(req.get("name") or "").strip().lower(), str(req.get("dob") or ""))
+
+    def book_many(self, requests, objective=None):
+        """
+        Book a list of referrals (dicts with start_booking's arguments as keys, plus
+        optional from_date/to_date) in one pass: patients are matched together and new
+        ones created with one save, slots are claimed inside one schedule batch (one lock,
+        one write), and confirmations and forms go out in batches. Returns one result per
+        request, in order, shaped like start_booking's; a request that can't be booked
+        gets an error result and the rest still go through. A request without a
+        preferred_doctor gets the earliest slot with any doctor (at its location, if set).
+        objective: None books first-fit in request order; "placements" or "wait" assigns
+        all the slots together first, one duration tier at a time (see tools/assignment.py).
+        """
+        results = [None] * len(requests)
+        if not requests:
+            return results
+
+        # 1. Identify patients; create the new ones (deduped within the batch) in one go
+        matches = self.patient_db.match_patients(requests)
+        new_keys = {}
+        for i, (req, (_, status, _)) in enumerate(zip(requests, matches)):
+            if status == "new":
+                new_keys.setdefault(self._referral_key(req), i)
+        created = self.patient_db.create_patients([requests[i] for i in new_keys.values()])
+        created_by_key = dict(zip(new_keys, created))
+
+        # 2. Determine durations
+        durations = [60 if status == "new" else 30 for _, status, _ in matches]
+
+        # 3./4. Pick and book slots against one schedule snapshot, written once
+        appts = []
+        with self.schedule_tool.batch():
+            assigned = [None] * len(requests)
+            if objective is not None:
+                # any-doctor requests are left to the clinic-wide search below
+                todo = [req.get("slot") is None and bool(req.get("preferred_doctor")) for req in requests]
+                assigned = assign_slots(self.schedule_tool, [
+                    {**req, "duration": d} for req, d, t in zip(requests, durations, todo) if t
+                ], objective=objective)
+                it = iter(assigned)
+                assigned = [next(it) if t else None for t in todo]
+            # slots fixed up front (given or assigned) are claimed before any first-fit search
+            for i in sorted(range(len(requests)), key=lambda i: requests[i].get("slot") is None and assigned[i] is None):
+                req = requests[i]
+                patient, status, _ = matches[i]
+                if status == "new":
+                    patient = created_by_key[self._referral_key(req)]
+                duration = durations[i]
+                doctor = req.get("preferred_doctor")
+                try:
+                    slot = req.get("slot") or assigned[i]
+                    if slot is None:
+                        slot = self._find_slot(doctor, duration, req.get("from_date"), req.get("to_date"),
+                                               req.get("location"))
+                        if slot is None:
+                            results[i] = {"status": "error",
+                                          "message": f"No available slots found for {doctor or 'any doctor'}."}
+                            continue
+                    slot = self._normalize_slot(slot)
+                    doctor = doctor or slot.get("doctor")
+                    # the record is built before the claim, so a bad request can't leave a
+                    # booked row without an appointment
+                    appt = self._new_appointment(patient, doctor, slot, duration, req.get("reason", ""),
+                                                 req.get("insurer", ""), req.get("member_id", ""),
+                                                 req.get("group_no", ""))
+                    if not self.schedule_tool.book_slot(doctor, slot, patient_id=patient["patient_id"]):
+                        results[i] = {"status": "error", "message": "Failed to book slot due to conflict."}
+                        continue
+                except Exception as e:
+                    # one bad request gets an error result; the rest of the batch still goes through
+                    results[i] = {"status": "error", "message": str(e) or type(e).__name__}
+                    continue
+                appts.append((i, appt))
+                results[i] = {
+                    "status": "ok",
+                    "message": f"Booked {doctor} on {slot['date'].isoformat()} {slot['start_time']}. Appointment ID: {appt['appt_id']}",
+                    "appt": appt
+                }
+        if not appts:
+            return results
+        appts = [appt for _, appt in sorted(appts, key=lambda item: item[0])]
+
+        # 5. Appointment records
+        with self._lock:
+            for appt in appts:
+                self.appointments.append(appt)
+            if self.storage is not None:
+                self.storage.insert_appointments(appts)
+        for appt in appts:
+            self.reminders.schedule(appt)
+
+        # 6./7. Confirmations, then intake forms
+        self.messaging.send_confirmations(appts)
+        self.form_sender.send_forms([(a["patient_email"], a["appt_id"]) for a in appts])
+        sent_at = datetime.utcnow().isoformat()
+        for appt in appts:
+            self._update_appointment(appt["appt_id"], forms_sent_at=sent_at)
+        return results
+
+    def export_appointments(self, path="data/appointments_export.xlsx", incremental=False, fmt="xlsx"):
+        """
+        Full export rewrites the whole workbook. incremental=True only writes the rows
+        created or changed since the last export (fmt: xlsx, csv or parquet) and returns
+        the delta path, or None if nothing changed. Stamping exported_at is not a change.
+        """
+        now = datetime.utcnow().isoformat()
+        with self._lock:
+            seq = self.appointments.seq
+            if not incremental:
+                # write first, so a failed export leaves the rows pending for the next one
+                df = self.appointments_df.copy()
+                df["exported_at"] = now
+                out = self.exporter.export(df)
+                self._mark_exported([appt["appt_id"] for appt in self.appointments], now)
+                self._export_seq = seq
+                return out
+            rows = self.appointments.changed_since(self._export_seq)
+            for appt in rows:
+                appt["exported_at"] = now
+            out = self.exporter.export_delta(rows, APPOINTMENT_COLS, fmt=fmt)
+            self._mark_exported([appt["appt_id"] for appt in rows], now)
+            self._export_seq = seq
+        return out
 
     def trigger_reminders(self):
         """
-        Simulate reminders:
+        Send the reminders that are due:
         - R1: after 10s from booking
         - R2: after 20s
         - R3: after 30s
-        (For demo only; in production this would be scheduled jobs)
+        (Demo timings. Only due entries are popped from the reminder queue; call
+        reminders.start() to have a background thread do this continuously.)
         """
-        now = datetime.utcnow()
-        for idx, row in self.appointments_df.iterrows():
-            created_at = datetime.fromisoformat(row["created_at"])
-            delta = (now - created_at).total_seconds()
-            appt_id = row["appt_id"]
-
-            # Reminder 1
-            if delta > 10 and not row["reminder1"]:
-                self.messaging.send_reminder(row, 1)
-                self.appointments_df.loc[idx, "reminder1"] = now.isoformat()
-
-            # Reminder 2
-            if delta > 20 and not row["reminder2"]:
-                self.messaging.send_reminder(row, 2)
-                self.appointments_df.loc[idx, "reminder2"] = now.isoformat()
-
-            # Reminder 3
-            if delta > 30 and not row["reminder3"]:
-                self.messaging.send_reminder(row, 3)
-                self.appointments_df.loc[idx, "reminder3"] = now.isoformat()
+        return self.reminders.run_due()
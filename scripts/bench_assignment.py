@@ -0,0 +1,106 @@
+"""
+Benchmark: batch slot assignment (tools/assignment.py) against first-fit booking.
+
+    python -m scripts.bench_assignment --doctors 10 --days 30 --requests 3000
+
+Builds a synthetic workbook (09:00-17:00 days of mixed 30/60-minute rows), generates
+requests with a doctor, a 60/30 duration and a window of acceptable days, then books
+them first-fit (find_slots(limit=1) + book_slot, in arrival order) and through
+assign_slots (every assigned slot is then claimed with book_slot as a check).
+"placements" is also run with each tier order on its own, to show how much the
+order of the duration tiers (longer visits first or shorter first) costs.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+from tools.assignment import OBJECTIVES, TIER_ORDERS, assign_slots
+from tools.schedule_excel import ScheduleExcel
+from tools.slot_index import _to_minutes
+
+def _hhmm(m):
+    return f"{m // 60:02d}:{m % 60:02d}"
+
+def make_workbook(path, doctors, days, rng):
+    first = date.today()
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for n in range(doctors):
+            rows = []
+            for k in range(days):
+                m = 9 * 60
+                while m < 17 * 60:
+                    length = 60 if rng.random() < 0.35 and m + 60 <= 17 * 60 else 30
+                    rows.append({"date": pd.Timestamp(first + timedelta(days=k)), "start_time": _hhmm(m),
+                                 "end_time": _hhmm(m + length), "slot_length": length, "status": "Available",
+                                 "patient_id": "", "notes": ""})
+                    m += length
+            pd.DataFrame(rows).to_excel(writer, sheet_name=f"Dr_{n:02d}", index=False)
+    return first
+
+def make_requests(n, doctors, days, first, rng):
+    reqs = []
+    for _ in range(n):
+        start = rng.randrange(days)
+        window = rng.randint(2, 10)
+        reqs.append({
+            "doctor": f"Dr_{rng.randrange(doctors):02d}",
+            "duration": 60 if rng.random() < 0.4 else 30,
+            "from_date": first + timedelta(days=start),
+            "to_date": first + timedelta(days=min(days - 1, start + window)),
+        })
+    return reqs
+
+def _wait_minutes(slot, first):
+    return (slot["date"] - first).days * 24 * 60 + _to_minutes(slot["start_time"])
+
+def _report(name, slots, first, seconds):
+    placed = [s for s in slots if s is not None]
+    wait = sum(_wait_minutes(s, first) for s in placed) / max(1, len(placed)) / (24 * 60)
+    print(f"{name:<36} placed {len(placed):>6} / {len(slots):<6} mean wait {wait:6.2f} days   {seconds:7.2f}s")
+
+def first_fit(path, reqs):
+    tool = ScheduleExcel(path, autoflush=False)   # in memory only; never flushed
+    out = []
+    for q in reqs:
+        found = tool.find_slots(q["doctor"], q["duration"], from_date=q["from_date"],
+                                limit=1, to_date=q["to_date"])
+        out.append(found[0] if found and tool.book_slot(q["doctor"], found[0]) else None)
+    return out
+
+def run(doctors, days, n_requests, seed):
+    rng = random.Random(seed)
+    tmpdir = tempfile.mkdtemp(prefix="bench_assignment_")
+    path = os.path.join(tmpdir, "schedules.xlsx")
+    first = make_workbook(path, doctors, days, rng)
+    reqs = make_requests(n_requests, doctors, days, first, rng)
+    print(f"{doctors} doctors x {days} days, {n_requests} requests")
+
+    t = time.perf_counter()
+    _report("first-fit", first_fit(path, reqs), first, time.perf_counter() - t)
+
+    runs = [(objective, None) for objective in OBJECTIVES] + [("placements", order) for order in TIER_ORDERS]
+    for objective, order in runs:
+        tool = ScheduleExcel(path, autoflush=False)
+        t = time.perf_counter()
+        slots = assign_slots(tool, reqs, objective=objective, tier_order=order)
+        elapsed = time.perf_counter() - t
+        for q, s in zip(reqs, slots):
+            assert s is None or tool.book_slot(q["doctor"], s), f"assigned slot could not be booked: {s}"
+        _report(f"assign ({objective}{', ' + order + ' first' if order else ''})", slots, first, elapsed)
+    shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--doctors", type=int, default=10)
+    ap.add_argument("--days", type=int, default=30)
+    ap.add_argument("--requests", type=int, default=3000)
+    ap.add_argument("--seed", type=int, default=7)
+    a = ap.parse_args()
+    run(a.doctors, a.days, a.requests, a.seed)
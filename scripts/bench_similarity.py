@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of the name similarity scorers (tools/similarity.py).
+
+    python -m scripts.bench_similarity --pairs 200000
+
+Times ratio() per pair for every available scorer on name pairs built from
+patients.csv (exact, typo'd and unrelated names), reports how far each strays from
+difflib, and times match_patient with each scorer over the registry.
+"""
+
+import argparse
+import random
+import time
+
+import pandas as pd
+
+from tools.patient_db import PatientDB, _clean_text
+from tools.similarity import SCORERS, get_scorer
+
+def _typo(name, rng):
+    chars = list(name)
+    i = rng.randrange(len(chars))
+    op = rng.random()
+    if op < 0.33:
+        chars[i] = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    elif op < 0.66:
+        del chars[i]
+    else:
+        chars.insert(i, rng.choice("abcdefghijklmnopqrstuvwxyz"))
+    return "".join(chars)
+
+def make_pairs(names, n, rng):
+    pairs = []
+    for _ in range(n):
+        a = rng.choice(names)
+        r = rng.random()
+        b = a if r < 0.1 else _typo(a, rng) if r < 0.5 else rng.choice(names)
+        pairs.append((a, b))
+    return pairs
+
+def available():
+    out = []
+    for name in SCORERS:
+        try:
+            out.append(get_scorer(name))
+        except ImportError:
+            print(f"{name:<10} (not installed)")
+    return out
+
+def run(csv_path, n_pairs, n_queries, seed):
+    rng = random.Random(seed)
+    patients = pd.read_csv(csv_path, dtype=str)
+    names = [_clean_text(n) for n in patients["name"].dropna()]
+    pairs = make_pairs(names, n_pairs, rng)
+    scorers = available()
+
+    reference = [get_scorer("difflib").ratio(a, b) for a, b in pairs]
+    print(f"ratio() over {n_pairs} name pairs")
+    for scorer in scorers:
+        t = time.perf_counter()
+        scores = [scorer.ratio(a, b) for a, b in pairs]
+        elapsed = time.perf_counter() - t
+        drift = max(abs(s - r) for s, r in zip(scores, reference))
+        print(f"  {scorer.name:<10} {elapsed / n_pairs * 1e6:7.2f} us/pair   max |score - difflib| {drift:.3f}")
+
+    queries = [(_typo(rng.choice(names), rng), row["dob"]) for _, row in patients.sample(
+        n_queries, replace=True, random_state=seed).iterrows()]
+    print(f"match_patient x {n_queries} (typo'd names, {len(patients)} patients)")
+    for scorer in scorers:
+        db = PatientDB(csv_path, scorer=scorer)
+        t = time.perf_counter()
+        for name, dob in queries:
+            db.match_patient(name, dob)
+        elapsed = time.perf_counter() - t
+        print(f"  {scorer.name:<10} {elapsed / n_queries * 1e3:7.3f} ms/query")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--csv", default="data/patients.csv")
+    ap.add_argument("--pairs", type=int, default=200_000)
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=7)
+    a = ap.parse_args()
+    run(a.csv, a.pairs, a.queries, a.seed)
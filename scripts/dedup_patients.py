@@ -0,0 +1,35 @@
+"""
+Find likely-duplicate patient records across the registry (see tools/dedup.py).
+
+    python -m scripts.dedup_patients --csv data/patients.csv --out data/duplicates.csv
+
+Writes one row per clustered patient (cluster_id, patient_id, name, dob, email, phone,
+score) and prints a summary of the clusters found.
+"""
+
+import argparse
+import time
+
+import pandas as pd
+
+from tools.dedup import cluster_summary, find_duplicates
+
+def run(csv_path, out_path, threshold, workers):
+    t = time.perf_counter()
+    patients = pd.read_csv(csv_path, dtype=str)
+    dupes = find_duplicates(patients, threshold=threshold, workers=workers)
+    dupes.to_csv(out_path, index=False)
+    clusters = cluster_summary(dupes)
+    print(f"{len(patients)} patients: {len(clusters)} duplicate clusters covering {len(dupes)} records "
+          f"({time.perf_counter() - t:.1f}s) -> {out_path}")
+    for c in clusters[:10]:
+        print(f"  {c['size']} records, min score {c['min_score']:.3f}: {', '.join(c['patient_ids'])}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--csv", default="data/patients.csv")
+    ap.add_argument("--out", default="data/duplicates.csv")
+    ap.add_argument("--threshold", type=float, default=0.85)
+    ap.add_argument("--workers", type=int, default=None)
+    a = ap.parse_args()
+    run(a.csv, a.out, a.threshold, a.workers)
@@ -0,0 +1,74 @@
+"""
+Stress harness: many processes race to book the same slots in one workbook copy,
+then we check that no row was won twice and that the file agrees with the winners.
+
+    python -m scripts.stress_booking --procs 8 --doctor Dr_Iyer
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+import pandas as pd
+
+from tools.schedule_excel import ScheduleExcel
+
+def _worker(args):
+    path, doctor, targets, worker_no = args
+    tool = ScheduleExcel(path)
+    rng = random.Random(worker_no)
+    targets = targets[:]
+    rng.shuffle(targets)
+    won = []
+    for slot in targets:
+        # drop the version token half the time to exercise the plain status check too
+        claim = dict(slot) if rng.random() < 0.5 else {k: v for k, v in slot.items() if k != "version"}
+        if tool.book_slot(doctor, claim, patient_id=f"W{worker_no}"):
+            won.append(slot)
+    return worker_no, won
+
+def _rows(slot):
+    # (date, start_minute) of every 30-minute step a slot covers
+    h, m = map(int, slot["start_time"].split(":"))
+    start = h * 60 + m
+    return {(slot["date"], start + k) for k in range(0, slot["slot_length"], 30)}
+
+def run(source, doctor, procs):
+    tmpdir = tempfile.mkdtemp(prefix="stress_booking_")
+    path = os.path.join(tmpdir, "schedules.xlsx")
+    shutil.copyfile(source, path)
+
+    tool = ScheduleExcel(path)
+    # single rows and overlapping 60m spans, so multi-row claims contend with single ones
+    targets = tool.find_slots(doctor, 30) + tool.find_slots(doctor, 60)
+    with Pool(procs) as pool:
+        results = pool.map(_worker, [(path, doctor, targets, n) for n in range(procs)])
+
+    owner = {}
+    for worker_no, won in results:
+        for slot in won:
+            for row in _rows(slot):
+                assert row not in owner, f"double booking: {row} won by W{owner[row]} and W{worker_no}"
+                owner[row] = worker_no
+
+    df = pd.read_excel(path, sheet_name=doctor, parse_dates=["date"])
+    booked = df[df["status"].str.lower() == "booked"]
+    for _, r in booked.iterrows():
+        h, m = map(int, r["start_time"].split(":"))
+        row = (r["date"].date(), h * 60 + m)
+        assert row in owner and r["patient_id"] == f"W{owner[row]}", f"file disagrees with winners at {row}"
+    wins = sum(len(won) for _, won in results)
+    print(f"{procs} processes, {len(targets)} contested slots: {wins} claims won, "
+          f"{len(booked)} rows booked, no double bookings")
+    shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--source", default="data/schedules.xlsx")
+    ap.add_argument("--doctor", default="Dr_Iyer")
+    ap.add_argument("--procs", type=int, default=8)
+    a = ap.parse_args()
+    run(a.source, a.doctor, a.procs)
@@ -0,0 +1,80 @@
+"""
+Check that the async messaging dispatcher survives failing log writes.
+
+    python -m scripts.stress_messaging --messages 2000
+
+Log writes fail at random (and for a stretch, every time); sends, flush() and close()
+must keep returning, the worker must stay alive, and every message must end up either
+in the log or counted as dropped. Then the worker is killed outright and flush()/close()
+must still return, with later sends written inline.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from tools.messaging import Messaging
+
+class FlakyMessaging(Messaging):
+    def __init__(self, *args, fail_rate=0.3, **kwargs):
+        self.fail_rate = fail_rate
+        self.fail_all = False
+        self.rng = random.Random(7)
+        super().__init__(*args, **kwargs)
+
+    def _write(self, records):
+        if self.fail_all or self.rng.random() < self.fail_rate:
+            raise OSError("simulated write failure")
+        super()._write(records)
+
+def _bounded(fn, seconds, what):
+    t = threading.Thread(target=fn, daemon=True)
+    t.start()
+    t.join(seconds)
+    assert not t.is_alive(), f"{what} did not return within {seconds}s"
+
+def run(n_messages):
+    tmpdir = tempfile.mkdtemp(prefix="stress_messaging_")
+    m = FlakyMessaging(log_path=os.path.join(tmpdir, "messaging.log"), async_dispatch=True,
+                       queue_size=50, flush_interval=0.05, batch_size=20)
+    m.write_retries = 2
+    def send(count):
+        for k in range(count):
+            m.send_sms("555", f"msg {k}")
+    t = time.perf_counter()
+    _bounded(lambda: send(n_messages // 2), 60, "sends with flaky writes")
+    m.fail_all = True
+    _bounded(lambda: send(n_messages // 2), 60, "sends while every write fails")
+    _bounded(m.flush, 30, "flush()")
+    assert m._worker.is_alive(), "worker died on a failing write"
+    m.fail_all = False
+    m.flush()
+    written = m.log.count()
+    assert written + m.dropped == n_messages // 2 * 2, (written, m.dropped)
+    print(f"{n_messages} sends: {written} written, {m.dropped} dropped after retries "
+          f"({time.perf_counter() - t:.1f}s), worker alive")
+
+    # a worker that dies anyway (the old failure mode) must not wedge flush/close or senders
+    def crash(batch):
+        raise RuntimeError("simulated worker crash")
+    m._write_batch = crash
+    threading.excepthook = lambda args: None   # keep the expected crash out of the output
+    m.send_sms("555", "kills the worker")
+    m._worker.join(5)
+    assert not m._worker.is_alive()
+    m.fail_rate = 0.0
+    _bounded(lambda: send(200), 30, "sends after the worker died")
+    _bounded(m.flush, 10, "flush() with a dead worker")
+    _bounded(m.close, 10, "close() with a dead worker")
+    print("dead worker: sends, flush() and close() return")
+    shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--messages", type=int, default=2000)
+    a = ap.parse_args()
+    run(a.messages)
@@ -0,0 +1,81 @@
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+class AppointmentStore:
+    """
+    Append-friendly appointment table: one Python list per column plus an appt_id -> row
+    index. Appends and field updates are O(1); a DataFrame is only built (and cached until
+    the next change) when something needs one for display or export.
+    Tracked changes stamp the row with a new change sequence number and move it to the
+    end of _changed, so changed_since() walks back only over rows newer than a watermark.
+    """
+    def __init__(self, columns: List[str]):
+        self.columns = list(columns)
+        self._cols: Dict[str, list] = {c: [] for c in self.columns}
+        self._pos: Dict[str, int] = {}
+        self._df: Optional[pd.DataFrame] = None
+        self.seq = 0                          # last change sequence number handed out
+        self._changed: Dict[int, int] = {}    # row -> seq of its last tracked change, in seq order
+
+    def __len__(self):
+        return len(self._cols["appt_id"])
+
+    def __contains__(self, appt_id):
+        return appt_id in self._pos
+
+    def _touch(self, i: int):
+        self.seq += 1
+        self._changed.pop(i, None)
+        self._changed[i] = self.seq
+
+    def append(self, appt: Dict, track: bool = True):
+        i = len(self)
+        self._pos[appt["appt_id"]] = i
+        for c in self.columns:
+            self._cols[c].append(appt.get(c, ""))
+        if track:
+            self._touch(i)
+        self._df = None
+
+    def update(self, appt_id: str, track: bool = True, **fields):
+        """Set fields on one appointment; track=False leaves its change seq alone (e.g. export stamps)."""
+        i = self._pos[appt_id]
+        for c, v in fields.items():
+            self._cols[c][i] = v
+        if track:
+            self._touch(i)
+        self._df = None
+
+    def fill(self, column: str, value):
+        """Set one column on every appointment."""
+        self._cols[column] = [value] * len(self)
+        self._df = None
+
+    def changed_since(self, seq: int) -> List[Dict]:
+        """Appointments appended or changed after change seq `seq`, oldest change first."""
+        rows = []
+        for i in reversed(self._changed):
+            if self._changed[i] <= seq:
+                break
+            rows.append(i)
+        return [self._record(i) for i in reversed(rows)]
+
+    def _record(self, i: int) -> Dict:
+        return {c: self._cols[c][i] for c in self.columns}
+
+    def get(self, appt_id: str) -> Optional[Dict]:
+        i = self._pos.get(appt_id)
+        return self._record(i) if i is not None else None
+
+    def last(self) -> Optional[Dict]:
+        return self._record(len(self) - 1) if len(self) else None
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self._record(i)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        if self._df is None:
+            self._df = pd.DataFrame(self._cols, columns=self.columns)
+        return self._df
@@ -0,0 +1,261 @@
+"""
+Batch slot assignment: place many pending requests at once instead of first-fit.
+
+Each request names a doctor, a duration (60 for new patients, 30 for returning ones)
+and the days it accepts (from_date/to_date, or an explicit "days" list). Requests are
+placed one duration tier at a time: the doctor's free rows are cut into disjoint
+options (a long-enough row on its own, or back-to-back shorter rows adding up to the
+duration), the tier's requests are matched to options as a bipartite graph, the rows
+used are removed, and the next tier is matched against what is left.
+
+Each tier gets a maximum matching, but the tiers compete for the same rows, so the
+total is not a maximum over all requests: two back-to-back 30m rows can take one 60m
+visit or two 30m visits, and whichever tier goes first wins them.
+
+objective="placements": most placements per tier (Hopcroft-Karp). Both tier orders
+are tried (longer visits first, then shorter first) and the one placing more requests
+is kept; ties keep longer visits first.
+objective="wait": longer visits first; each tier places its maximum number of requests
+but picks the earliest set of slots: options are taken in time order and kept whenever
+an augmenting path can still fit them in (greedy on the transversal matroid), which
+minimises the tier's total wait from today.
+"""
+
+import bisect
+from collections import deque
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from tools.slot_index import _to_minutes
+
+OBJECTIVES = ("placements", "wait")
+TIER_ORDERS = ("longest", "shortest")
+
+def _as_date(d):
+    # blank bounds (bulk CSVs are read with fillna("")), NaN and NaT mean "no bound"
+    if isinstance(d, str):
+        d = d.strip() or None
+    if d is None or pd.isna(d):
+        return None
+    d = pd.to_datetime(d)
+    return None if pd.isna(d) else d.date()
+
+def free_rows(schedule_tool, doctor, from_date=None, to_date=None) -> List[Dict]:
+    """Every free row of a doctor, in (date, start) order (a 1-minute search spans single rows)."""
+    return schedule_tool.find_slots(doctor, 1, from_date=from_date, to_date=to_date)
+
+def _options(rows: List[Dict], minutes: int) -> List[List[Dict]]:
+    """Cut free rows into disjoint bookable options of at least `minutes`."""
+    out = []
+    pending = []
+    for row in rows:
+        if pending and (pending[-1]["date"] != row["date"] or pending[-1]["end_time"] != row["start_time"]):
+            pending = []
+        if row["slot_length"] >= minutes:
+            out.append([row])
+            pending = []
+            continue
+        pending.append(row)
+        if sum(r["slot_length"] for r in pending) >= minutes:
+            out.append(pending)
+            pending = []
+    return out
+
+def _span(rows: List[Dict]) -> Dict:
+    # same shape as ScheduleExcel.find_slots results, so book_slot takes it as is
+    return {
+        "date": rows[0]["date"],
+        "start_time": rows[0]["start_time"],
+        "end_time": rows[-1]["end_time"],
+        "slot_length": sum(r["slot_length"] for r in rows),
+        "version": sum(r.get("version", 0) for r in rows)
+    }
+
+def hopcroft_karp(adj, n_right: int) -> List[int]:
+    """Maximum bipartite matching. adj[u] lists the rights of left u; returns right per left or -1."""
+    n = len(adj)
+    match_l = [-1] * n
+    match_r = [-1] * n_right
+    while True:
+        # BFS: layer the lefts by alternating distance from the free ones
+        dist = [-1] * n
+        q = deque(u for u in range(n) if match_l[u] == -1)
+        for u in q:
+            dist[u] = 0
+        found = False
+        while q:
+            u = q.popleft()
+            for v in adj[u]:
+                w = match_r[v]
+                if w == -1:
+                    found = True
+                elif dist[w] == -1:
+                    dist[w] = dist[u] + 1
+                    q.append(w)
+        if not found:
+            return match_l
+        # DFS along the layers for vertex-disjoint shortest augmenting paths
+        for u in range(n):
+            if match_l[u] != -1:
+                continue
+            stack, its, via = [u], [iter(adj[u])], []
+            while stack:
+                x = stack[-1]
+                for v in its[-1]:
+                    w = match_r[v]
+                    if w == -1:
+                        via.append(v)
+                        for a, b in zip(stack, via):
+                            match_l[a] = b
+                            match_r[b] = a
+                        stack = []
+                        break
+                    if dist[w] == dist[x] + 1:
+                        via.append(v)
+                        stack.append(w)
+                        its.append(iter(adj[w]))
+                        break
+                else:
+                    dist[x] = -2  # dead end for this phase
+                    stack.pop()
+                    its.pop()
+                    if via:
+                        via.pop()
+
+def earliest_matching(adj, n_right: int) -> List[int]:
+    """
+    Maximum matching that uses the earliest rights: rights are tried in index order and
+    kept when an augmenting path reaches a free left. Rights must be numbered in time order.
+    """
+    n = len(adj)
+    match_l = [-1] * n
+    match_r = [-1] * n_right
+    # right -> lefts, most urgent (earliest last acceptable right) first
+    deadline = [a[-1] if len(a) else -1 for a in adj]
+    radj = [[] for _ in range(n_right)]
+    for u in sorted(range(n), key=deadline.__getitem__):
+        for v in adj[u]:
+            radj[v].append(u)
+    seen = [False] * n
+    for s in range(n_right):
+        if not radj[s]:
+            continue
+        # visited marks stay valid across failed searches; only a success resets them
+        stack, its, via = [s], [iter(radj[s])], []
+        done = False
+        while stack and not done:
+            r = stack[-1]
+            free = next((u for u in radj[r] if match_l[u] == -1 and not seen[u]), None)
+            if free is not None:
+                via.append(free)
+                for a, b in zip(stack, via):
+                    match_r[a] = b
+                    match_l[b] = a
+                done = True
+                break
+            for u in its[-1]:
+                if seen[u]:
+                    continue
+                seen[u] = True
+                via.append(u)
+                stack.append(match_l[u])
+                its.append(iter(radj[match_l[u]]))
+                break
+            else:
+                stack.pop()
+                its.pop()
+                if via:
+                    via.pop()
+        if done:
+            seen = [False] * n
+    return match_l
+
+def assign_slots(schedule_tool, requests: List[Dict], objective: str = "placements",
+                 tier_order: Optional[str] = None) -> List[Optional[Dict]]:
+    """
+    Assign slots to many requests at once. A request is a dict with "doctor" (or
+    "preferred_doctor"), "duration" (minutes, default 30) and either from_date/to_date
+    (inclusive, both optional) or "days". Returns one slot dict (as from find_slots) or
+    None per request, in order. Nothing is booked; pass the slots to book_slot/book_many.
+    tier_order: "longest" or "shortest" first; default: both for "placements" (the
+    better one is kept), longest first for "wait".
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"objective must be one of {OBJECTIVES}")
+    if tier_order not in (None,) + TIER_ORDERS:
+        raise ValueError(f"tier_order must be one of {TIER_ORDERS}")
+    reqs = []
+    for r in requests:
+        days = r.get("days")
+        reqs.append({
+            "doctor": r.get("doctor") or r.get("preferred_doctor"),
+            "duration": int(r.get("duration") or 30),
+            "from": _as_date(r.get("from_date")),
+            "to": _as_date(r.get("to_date")),
+            "days": sorted({_as_date(d) for d in days} - {None}) if days is not None else None,
+        })
+
+    # one read of each doctor's free rows, bounded by the requests' windows
+    rows_by_doctor = {}
+    known = set(schedule_tool.list_doctors())
+    for doctor in dict.fromkeys(q["doctor"] for q in reqs):
+        mine = [q for q in reqs if q["doctor"] == doctor]
+        starts = [q["days"][0] if q["days"] else q["from"] for q in mine]
+        ends = [q["days"][-1] if q["days"] else q["to"] for q in mine]
+        lo = None if None in starts else min(starts)
+        hi = None if None in ends else max(ends)
+        if doctor not in known:
+            rows_by_doctor[doctor] = []   # unknown doctor: its requests stay unplaced
+            continue
+        rows_by_doctor[doctor] = free_rows(schedule_tool, doctor, lo, hi)
+
+    tiers = sorted({q["duration"] for q in reqs}, reverse=True)
+    orders = {"longest": tiers, "shortest": tiers[::-1]}
+    if tier_order is not None:
+        candidates = [orders[tier_order]]
+    elif objective == "placements":
+        candidates = [orders["longest"], orders["shortest"]]
+    else:
+        candidates = [orders["longest"]]
+    match_fn = hopcroft_karp if objective == "placements" else earliest_matching
+    runs = [_assign_tiers(reqs, rows_by_doctor, order, match_fn) for order in candidates]
+    # max keeps the first (longer visits first) on ties
+    return max(runs, key=lambda res: sum(r is not None for r in res))
+
+def _assign_tiers(reqs, rows_by_doctor, tiers, match_fn) -> List[Optional[Dict]]:
+    """Match each duration tier in turn against the rows earlier tiers left free."""
+    results: List[Optional[Dict]] = [None] * len(reqs)
+    used = set()   # (doctor, date, start_time) of rows already assigned
+    for minutes in tiers:
+        idx = [i for i, q in enumerate(reqs) if q["duration"] == minutes]
+        options = []   # (doctor, rows) numbered in (doctor, date, start) order
+        keys = {}      # doctor -> (first option id, [(date, start_minute)] per option)
+        for doctor, rows in rows_by_doctor.items():
+            opts = _options([r for r in rows if (doctor, r["date"], r["start_time"]) not in used], minutes)
+            keys[doctor] = (len(options), [(o[0]["date"], _to_minutes(o[0]["start_time"])) for o in opts])
+            options.extend((doctor, o) for o in opts)
+
+        adj = []
+        for i in idx:
+            q = reqs[i]
+            base, k = keys.get(q["doctor"], (0, []))
+            if q["days"] is None:
+                lo = bisect.bisect_left(k, (q["from"], -1)) if q["from"] else 0
+                hi = bisect.bisect_right(k, (q["to"], 24 * 60)) if q["to"] else len(k)
+                adj.append(range(base + lo, base + hi))
+            else:
+                adj.append([
+                    base + j
+                    for d in q["days"]
+                    for j in range(bisect.bisect_left(k, (d, -1)), bisect.bisect_right(k, (d, 24 * 60)))
+                ])
+
+        match = match_fn(adj, len(options))
+        for i, o in zip(idx, match):
+            if o == -1:
+                continue
+            doctor, rows = options[o]
+            results[i] = _span(rows)
+            used.update((doctor, r["date"], r["start_time"]) for r in rows)
+    return results
@@ -0,0 +1,197 @@
+"""
+Bulk duplicate detection across the whole patient registry.
+
+Instead of match_patient per row (every row against every other), rows are grouped by
+blocking keys — same DOB, same phone suffix, same email, or one of the name's two
+rarest trigrams — and only pairs inside a block are compared. Oversized blocks are
+reduced to a sorted-by-name neighbourhood window. Scoring follows match_patient: an
+exact email/phone match is 1.0, otherwise name_weight * name similarity + dob_weight *
+same DOB. Exact features and a character-multiset bound (from per-row character histograms)
+are computed with numpy over the pairs in chunks; only the pairs that survive get a
+similarity ratio (tools/similarity.py), spread over a process pool. Linked pairs are merged into
+clusters with union-find.
+"""
+
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from tools.patient_db import DOB_WEIGHT, NAME_WEIGHT, NORM_COLS, _add_norm_columns, _name_grams
+from tools.similarity import get_scorer
+
+PHONE_SUFFIX = 7          # digits of the phone number used as a blocking key
+MISSING = ("", "nan")     # what missing values normalize to
+
+def _name_ratios(job) -> List[float]:
+    """Similarity ratios for (name_a, name_b) pairs (runs in the worker processes)."""
+    scorer_name, pairs = job
+    scorer = get_scorer(scorer_name)
+    return [scorer.ratio(a, b) for a, b in pairs]
+
+def _char_histograms(names: pd.Series) -> np.ndarray:
+    """Per-row counts of a-z, 0-9, space and 'other' (the alphabet quick_ratio works over)."""
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789 "
+    hist = np.zeros((len(names), len(alphabet) + 1), dtype=np.uint8)
+    for k, ch in enumerate(alphabet):
+        hist[:, k] = names.str.count(ch if ch != " " else r"\s").clip(upper=255).to_numpy()
+    hist[:, -1] = (names.str.len().to_numpy() - hist[:, :-1].sum(1)).clip(0, 255)
+    return hist
+
+def _codes(col: pd.Series) -> np.ndarray:
+    """Integer code per value, -1 for missing, so equality tests run as array compares."""
+    codes, _ = pd.factorize(col.where(~col.isin(MISSING)))
+    return codes
+
+def _block_keys(df: pd.DataFrame) -> pd.Series:
+    """(row position, blocking key) pairs as one Series indexed by row position."""
+    keys = [
+        "d:" + df["dob_norm"].astype(str),
+        "e:" + df["email_norm"],
+        "p:" + df["phone_norm"].str[-PHONE_SUFFIX:].where(df["phone_norm"].str.len() >= PHONE_SUFFIX, ""),
+    ]
+    keep = [~df["dob_norm"].astype(str).isin(MISSING), ~df["email_norm"].isin(MISSING),
+            df["phone_norm"].str.len() >= PHONE_SUFFIX]
+    out = [k[m] for k, m in zip(keys, keep)]
+    # name blocks: each name's two rarest trigrams
+    grams = [sorted(_name_grams(n)) if n not in MISSING else [] for n in df["name_norm"]]
+    freq = Counter(g for gs in grams for g in gs)
+    pos, name_keys = [], []
+    for i, gs in enumerate(grams):
+        for g in sorted(gs, key=lambda g: (freq[g], g))[:2]:
+            pos.append(i)
+            name_keys.append("n:" + g)
+    out.append(pd.Series(name_keys, index=pos, dtype=object))
+    return pd.concat(out)
+
+def _candidate_pairs(df: pd.DataFrame, max_block: int, window: int) -> np.ndarray:
+    """
+    Unique row pairs sharing at least one blocking key, as int64 codes i * n + j (i < j).
+    Keys are sorted (then by name) and rows k apart are paired when they share a key:
+    every k inside blocks of up to max_block rows, only k <= window inside bigger ones.
+    """
+    keys = _block_keys(df)
+    n = len(df)
+    key_codes, _ = pd.factorize(keys.to_numpy())
+    rows = keys.index.to_numpy()
+    order = np.lexsort((df["name_norm"].to_numpy()[rows].astype(str), key_codes))
+    key_codes, rows = key_codes[order], rows[order].astype(np.int64)
+    sizes = np.bincount(key_codes)[key_codes]
+    chunks = []
+    for k in range(1, max_block):
+        same = key_codes[:-k] == key_codes[k:]
+        if k > window:
+            same &= sizes[:-k] <= max_block
+        if not same.any():
+            break
+        i, j = rows[:-k][same], rows[k:][same]
+        lo, hi = np.minimum(i, j), np.maximum(i, j)
+        chunks.append(lo[lo != hi] * n + hi[lo != hi])
+    if not chunks:
+        return np.empty(0, dtype=np.int64)
+    codes = np.sort(np.concatenate(chunks))
+    return codes[np.r_[True, codes[1:] != codes[:-1]]]
+
+def _union_find(pairs: np.ndarray) -> Dict[int, int]:
+    """Row -> cluster root (the smallest row position in its cluster) for linked rows."""
+    parent: Dict[int, int] = {}
+    def root(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    for a, b in pairs.tolist():
+        ra, rb = root(a), root(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return {x: root(x) for x in list(parent)}
+
+def find_duplicates(patients: pd.DataFrame, threshold: float = 0.85, workers: Optional[int] = None,
+                    max_block: int = 100, window: int = 10, chunk_size: int = 200_000, scorer: str = "auto",
+                    name_weight: float = NAME_WEIGHT, dob_weight: float = DOB_WEIGHT) -> pd.DataFrame:
+    """
+    Cluster likely-duplicate patient rows. scorer is a similarity backend name (it is
+    rebuilt in each worker process). Returns one row per clustered patient with
+    cluster_id (the cluster's first row position), patient_id, name, dob, email, phone and
+    score (the best link score that joined the row to its cluster); rows with no
+    duplicate are left out. workers: process pool size (default: CPU count, 1 = in-process).
+    """
+    df = patients.reset_index(drop=True)
+    if not set(NORM_COLS) <= set(df.columns):
+        df = df.copy()
+        _add_norm_columns(df)
+    codes = _candidate_pairs(df, max_block, window)
+    cols = ["cluster_id", "patient_id", "name", "dob", "email", "phone", "score"]
+    n = len(df)
+
+    dob = _codes(df["dob_norm"].astype(str))
+    email = _codes(df["email_norm"])
+    phone = _codes(df["phone_norm"])
+    names = df["name_norm"].astype(str)
+    lengths = names.str.len().to_numpy()
+    hist = _char_histograms(names)
+
+    # exact features and the quick_ratio bound, vectorized chunk by chunk; only pairs
+    # that are exact matches or could still reach the threshold are kept
+    kept_a, kept_b, kept_exact, kept_dob = [], [], [], []
+    for s in range(0, len(codes), chunk_size):
+        a, b = np.divmod(codes[s:s + chunk_size], n)
+        dob_eq = (dob[a] == dob[b]) & (dob[a] >= 0)
+        exact = ((email[a] == email[b]) & (email[a] >= 0)) | ((phone[a] == phone[b]) & (phone[a] >= 0))
+        common = np.minimum(hist[a], hist[b]).sum(1)
+        total = lengths[a] + lengths[b]
+        bound = np.where(total > 0, 2.0 * common / np.maximum(total, 1), 1.0)
+        keep = exact | (name_weight * bound + dob_weight * dob_eq >= threshold)
+        kept_a.append(a[keep]); kept_b.append(b[keep])
+        kept_exact.append(exact[keep]); kept_dob.append(dob_eq[keep])
+    if not kept_a:
+        return pd.DataFrame(columns=cols)
+    a, b = np.concatenate(kept_a), np.concatenate(kept_b)
+    exact, dob_eq = np.concatenate(kept_exact), np.concatenate(kept_dob)
+
+    # SequenceMatcher ratios only for the non-exact survivors, over the process pool
+    name_score = np.zeros(len(a))
+    todo = np.flatnonzero(~exact)
+    if len(todo):
+        name_list = names.tolist()
+        jobs = [(scorer, [(name_list[a[k]], name_list[b[k]]) for k in todo[s:s + chunk_size]])
+                for s in range(0, len(todo), chunk_size)]
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                ratios = [r for part in pool.map(_name_ratios, jobs) for r in part]
+        else:
+            ratios = [r for job in jobs for r in _name_ratios(job)]
+        name_score[todo] = ratios
+    score = np.where(exact, 1.0, name_weight * name_score + dob_weight * dob_eq)
+    linked = score >= threshold
+    if not linked.any():
+        return pd.DataFrame(columns=cols)
+
+    roots = _union_find(np.stack([a[linked], b[linked]], axis=1))
+    best = np.zeros(n)
+    np.maximum.at(best, a[linked], score[linked])
+    np.maximum.at(best, b[linked], score[linked])
+    members = np.flatnonzero(best > 0)
+    out = pd.DataFrame({
+        "cluster_id": [roots[m] for m in members.tolist()],
+        "patient_id": df["patient_id"].to_numpy()[members],
+        "name": df["name"].to_numpy()[members],
+        "dob": df["dob"].to_numpy()[members],
+        "email": df["email"].to_numpy()[members],
+        "phone": df["phone"].to_numpy()[members],
+        "score": best[members].round(3),
+    }, columns=cols)
+    return out.sort_values(["cluster_id", "score"], ascending=[True, False], kind="stable").reset_index(drop=True)
+
+def cluster_summary(dupes: pd.DataFrame) -> List[Dict]:
+    """One dict per cluster: cluster_id, size, patient_ids and the weakest link score."""
+    return [
+        {"cluster_id": int(cid), "size": len(g), "patient_ids": g["patient_id"].tolist(),
+         "min_score": float(g["score"].min())}
+        for cid, g in dupes.groupby("cluster_id", sort=True)
+    ]
@@ -1,8 +1,14 @@
+import csv
+import os
+from datetime import datetime
+
 import pandas as pd
 
 class Exporter:
-    def __init__(self, out_path="data/appointments_export.xlsx"):
+    def __init__(self, out_path="data/appointments_export.xlsx", delta_folder="data/exports"):
         self.out_path = out_path
+        # incremental exports: one delta file per export for xlsx/parquet, one growing CSV
+        self.delta_folder = delta_folder
 
     def export(self, appointments_df):
         # minimal cleaning before export
@@ -11,3 +17,57 @@ class Exporter:
         cols = [c for c in df.columns]
         df.to_excel(self.out_path, index=False)
         return self.out_path
+
+    def export_delta(self, records, columns, fmt="xlsx"):
+        """
+        Write only the given appointment records (the rows changed since the last export).
+        xlsx is streamed with openpyxl's write-only workbook and parquet (needs pyarrow) goes
+        to a new delta file per export; csv appends to one appointments_export.csv.
+        Returns the path written, or None when there was nothing to export.
+        """
+        if not records:
+            return None
+        os.makedirs(self.delta_folder, exist_ok=True)
+        if fmt == "csv":
+            return self._append_csv(records, columns)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        path = os.path.join(self.delta_folder, f"appointments_{stamp}.{fmt}")
+        if fmt == "xlsx":
+            self._write_xlsx(path, records, columns)
+        elif fmt == "parquet":
+            self._write_parquet(path, records, columns)
+        else:
+            raise ValueError(f"Unknown export format: {fmt}")
+        return path
+
+    def _append_csv(self, records, columns):
+        path = os.path.join(self.delta_folder, "appointments_export.csv")
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+            if new_file:
+                w.writeheader()
+            w.writerows(records)
+        return path
+
+    @staticmethod
+    def _write_xlsx(path, records, columns):
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("appointments")
+        ws.append(columns)
+        for r in records:
+            ws.append([r.get(c, "") for c in columns])
+        tmp = path + ".tmp"
+        wb.save(tmp)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _write_parquet(path, records, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        # everything as strings, like the app's Arrow-safe display of the table
+        table = pa.table({c: [str(r.get(c, "")) for r in records] for c in columns})
+        tmp = path + ".tmp"
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
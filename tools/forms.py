@@ -1,30 +1,92 @@
+import hashlib
+import json
 import os
 import shutil
 from datetime import datetime
 
+FICLONE = 0x40049409  # Linux ioctl: share the source file's extents (reflink)
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
 class FormSender:
-    def __init__(self, intake_pdf_path, out_folder="data/forms_sent"):
+    def __init__(self, intake_pdf_path, out_folder="data/forms_sent", materialize=None):
+        """
+        The intake PDF is stored once under out_folder/blobs/<sha256>.pdf and every send
+        appends one line to out_folder/manifest.jsonl pointing at that blob.
+        materialize: None (manifest only), or "hardlink" / "reflink" / "copy" to also
+        create out_folder/<appt_id>_intake.pdf; links fall back to a copy when the
+        filesystem can't do them.
+        """
         self.intake_pdf_path = intake_pdf_path
         self.out_folder = out_folder
-        os.makedirs(out_folder, exist_ok=True)
+        self.materialize = materialize
+        self.blob_folder = os.path.join(out_folder, "blobs")
+        self.manifest_path = os.path.join(out_folder, "manifest.jsonl")
+        self._blob = None   # (template stamp, sha256, blob path)
+        os.makedirs(self.blob_folder, exist_ok=True)
+
+    def _template_blob(self):
+        # hash the template once (again only if it changes) and store it by content
+        st = os.stat(self.intake_pdf_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if self._blob is None or self._blob[0] != stamp:
+            h = hashlib.sha256()
+            with open(self.intake_pdf_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            blob_path = os.path.join(self.blob_folder, f"{digest}.pdf")
+            if not os.path.exists(blob_path):
+                tmp = blob_path + ".tmp"
+                shutil.copyfile(self.intake_pdf_path, tmp)
+                os.replace(tmp, blob_path)
+            self._blob = (stamp, digest, blob_path)
+        return self._blob[1], self._blob[2]
+
+    def _materialize(self, blob_path, dest):
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            if self.materialize == "hardlink":
+                os.link(blob_path, dest)
+                return
+            if self.materialize == "reflink":
+                _reflink(blob_path, dest)
+                return
+        except (OSError, ImportError):
+            pass
+        shutil.copyfile(blob_path, dest)
 
     def send_form(self, patient_email, appt_id):
         """
-        Simulate sending form: copy the intake PDF to data/forms_sent/<appt_id>_intake.pdf
-        and log a small metadata file.
+        Simulate sending form: record a manifest entry pointing at the shared intake PDF
+        blob. Returns the path of the PDF that was "sent".
         """
+        return self.send_forms([(patient_email, appt_id)])[0]
+
+    def send_forms(self, recipients):
+        """send_form for many (patient_email, appt_id) pairs with one manifest write."""
         if not os.path.exists(self.intake_pdf_path):
             raise FileNotFoundError("Intake PDF not found.")
-        dest = os.path.join(self.out_folder, f"{appt_id}_intake.pdf")
-        shutil.copyfile(self.intake_pdf_path, dest)
-        # write metadata
-        meta = {
-            "appt_id": appt_id,
-            "patient_email": patient_email,
-            "sent_at": datetime.utcnow().isoformat(),
-            "file": dest
-        }
-        with open(os.path.join(self.out_folder, f"{appt_id}_meta.json"), "w") as f:
-            import json
-            json.dump(meta, f, indent=2)
-        return dest
+        digest, blob_path = self._template_blob()
+        sent_at = datetime.utcnow().isoformat()
+        paths, lines = [], []
+        for patient_email, appt_id in recipients:
+            dest = blob_path
+            if self.materialize:
+                dest = os.path.join(self.out_folder, f"{appt_id}_intake.pdf")
+                self._materialize(blob_path, dest)
+            paths.append(dest)
+            entry = {
+                "appt_id": appt_id,
+                "patient_email": patient_email,
+                "sent_at": sent_at,
+                "blob": digest
+            }
+            lines.append(json.dumps(entry) + "\n")
+        with open(self.manifest_path, "a") as f:
+            f.write("".join(lines))
+        return paths
@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from tools.file_lock import FileLock
+
+class MessageLog:
+    """
+    JSON-lines message log that rotates by size (max_bytes) and/or age (max_age seconds).
+    Older segments are kept as <path>.1 .. <path>.<backup_count>. Each segment has a
+    sidecar <segment>.idx with one "offset length ts appt_id" line per message, loaded
+    into memory at startup, so tail/page/for_appointment/between seek straight to the
+    lines they need instead of reading the whole log.
+
+    Several MessageLog instances (threads, sessions or processes) can share one path:
+    writes and rotations run under a cross-process FileLock on <path>.lock, each index
+    offset is taken from where the bytes actually landed, and an instance re-reads the
+    indexes whenever the lock's generation shows another writer got there first.
+    backup_count=0 keeps no old segments: rotating truncates the log instead.
+    """
+    def __init__(self, path="data/messaging.log", max_bytes=5_000_000, backup_count=5, max_age=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._flock = FileLock(path + ".lock")
+        self._generation = 0
+        # entries in write order: (ts, segment_id, offset, length). Segment ids only grow;
+        # the active file is self._active and segment s lives at _segment_path(s).
+        self._entries: List[Tuple[str, int, int, int]] = []
+        self._ts: List[str] = []               # entry timestamps, for bisecting by time
+        self._dropped = 0                      # entries trimmed off the front by rotation
+        self._by_appt: Dict[str, List[int]] = {}  # appt_id -> absolute entry numbers
+        self._active = backup_count
+        self._size = 0
+        self._started = time.time()
+        with self._flock:
+            self._load()
+            self._generation = self._flock.generation()
+
+    def _segment_path(self, seg: int) -> str:
+        back = self._active - seg
+        return self.path if back == 0 else f"{self.path}.{back}"
+
+    def _add_entry(self, ts, seg, offset, length, appt_id):
+        n = self._dropped + len(self._entries)
+        self._entries.append((ts, seg, offset, length))
+        self._ts.append(ts)
+        if appt_id:
+            self._by_appt.setdefault(appt_id, []).append(n)
+
+    def _load(self):
+        # call under self._flock: a stale index is rewritten in place
+        for seg in range(self._active - self.backup_count, self._active + 1):
+            path = self._segment_path(seg)
+            if not os.path.exists(path):
+                continue
+            size = os.path.getsize(path)
+            kept, end, stale = self._read_index(path, size)
+            for ts, offset, length, appt_id in kept:
+                self._add_entry(ts, seg, offset, length, appt_id)
+            if stale:
+                with open(path + ".idx", "w") as f:
+                    f.write("".join(f"{o} {n} {ts} {a}\n" for ts, o, n, a in kept))
+            # lines with no index entry (older logs, a crash between the two writes,
+            # or entries that disagreed with the file)
+            if end < size:
+                self._index_tail(path, seg, end)
+        self._size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        # age of the active segment = time of its first message
+        first = next((e[0] for e in self._entries if e[1] == self._active), None)
+        if first:
+            try:
+                self._started = datetime.fromisoformat(first).replace(tzinfo=timezone.utc).timestamp()
+            except ValueError:
+                pass
+
+    @staticmethod
+    def _read_index(path, size):
+        """
+        The entries of path's .idx that agree with the file: each must start where the
+        previous one ended and end inside the file, on a newline. Returns (entries, end
+        of the last one, whether any were dropped); the rest of the file is re-indexed.
+        """
+        kept, end, stale = [], 0, False
+        if not os.path.exists(path + ".idx"):
+            return kept, end, stale
+        with open(path + ".idx") as f:
+            for line in f:
+                parts = line.rstrip("\n").split(" ", 3)
+                if len(parts) < 3:
+                    continue
+                offset, length = int(parts[0]), int(parts[1])
+                if offset != end or length <= 0 or offset + length > size:
+                    stale = True
+                    break
+                kept.append((parts[2], offset, length, parts[3] if len(parts) > 3 else ""))
+                end = offset + length
+        if end:
+            with open(path, "rb") as f:
+                f.seek(end - 1)
+                if f.read(1) != b"\n":
+                    kept, end, stale = [], 0, True
+        return kept, end, stale
+
+    def _sync_locked(self):
+        # under the flock: re-read the indexes if another instance wrote since we did
+        generation = self._flock.generation()
+        if generation != self._generation:
+            self._entries, self._ts, self._by_appt = [], [], {}
+            self._dropped = 0
+            self._active = self.backup_count
+            self._size = 0
+            self._started = time.time()
+            self._load()
+            self._generation = generation
+
+    @contextmanager
+    def _synced(self):
+        with self._lock, self._flock:
+            self._sync_locked()
+            yield
+
+    def _index_tail(self, path, seg, start):
+        idx_lines = []
+        with open(path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                try:
+                    msg = json.loads(raw)
+                except ValueError:
+                    msg = {}
+                ts, appt_id = str(msg.get("ts", "")), str(msg.get("appt_id") or "")
+                self._add_entry(ts, seg, offset, len(raw), appt_id)
+                idx_lines.append(f"{offset} {len(raw)} {ts} {appt_id}\n")
+                offset += len(raw)
+        with open(path + ".idx", "a") as f:
+            f.write("".join(idx_lines))
+
+    def _rotate(self):
+        if not self.backup_count:
+            # no backups to keep: start the active segment over
+            for suffix in ("", ".idx"):
+                if os.path.exists(self.path + suffix):
+                    open(self.path + suffix, "wb").close()
+        for back in range(self.backup_count, 0, -1):
+            src = self.path if back == 1 else f"{self.path}.{back - 1}"
+            for suffix in ("", ".idx"):
+                if os.path.exists(src + suffix):
+                    os.replace(src + suffix, f"{self.path}.{back}{suffix}")
+        self._active += 1
+        # forget entries whose segment fell off the end
+        oldest = self._active - self.backup_count
+        k = 0
+        while k < len(self._entries) and self._entries[k][1] < oldest:
+            k += 1
+        if k:
+            del self._entries[:k]
+            del self._ts[:k]
+            self._dropped += k
+            for appt_id in list(self._by_appt):
+                kept = [n for n in self._by_appt[appt_id] if n >= self._dropped]
+                if kept:
+                    self._by_appt[appt_id] = kept
+                else:
+                    del self._by_appt[appt_id]
+        self._size = 0
+        self._started = time.time()
+
+    def append(self, records):
+        """
+        Write (ts, appt_id, json_line) records with one open of the log and of its index.
+        Offsets come from the end of the file as opened for append, under the file lock.
+        """
+        with self._synced():
+            data = [(ts, appt_id or "", (line + "\n").encode("utf-8")) for ts, appt_id, line in records]
+            batch = sum(len(b) for _, _, b in data)
+            self._size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            too_big = self.max_bytes and self._size and self._size + batch > self.max_bytes
+            too_old = self.max_age and self._size and time.time() - self._started > self.max_age
+            if too_big or too_old:
+                self._rotate()
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(b"".join(b for _, _, b in data))
+            idx_lines = []
+            for ts, appt_id, b in data:
+                self._add_entry(ts, self._active, offset, len(b), appt_id)
+                idx_lines.append(f"{offset} {len(b)} {ts} {appt_id}\n")
+                offset += len(b)
+            with open(self.path + ".idx", "a") as f:
+                f.write("".join(idx_lines))
+            self._size = offset
+            self._generation = self._flock.bump_generation()
+
+    def _read(self, entries) -> List[Dict]:
+        out = []
+        handles = {}
+        try:
+            for _, seg, offset, length in entries:
+                path = self._segment_path(seg)
+                if path not in handles:
+                    handles[path] = open(path, "rb")
+                f = handles[path]
+                f.seek(offset)
+                out.append(json.loads(f.read(length)))
+        finally:
+            for f in handles.values():
+                f.close()
+        return out
+
+    def count(self) -> int:
+        with self._synced():
+            return len(self._entries)
+
+    def tail(self, n=50) -> List[Dict]:
+        """Last n messages, oldest first."""
+        with self._synced():
+            return self._read(self._entries[-n:]) if n > 0 else []
+
+    def page(self, page_no=0, page_size=50) -> List[Dict]:
+        """Page page_no of the log, newest page first (page 0 is the latest page_size messages)."""
+        with self._synced():
+            end = len(self._entries) - page_no * page_size
+            if end <= 0:
+                return []
+            return self._read(self._entries[max(0, end - page_size):end])
+
+    def for_appointment(self, appt_id) -> List[Dict]:
+        with self._synced():
+            return self._read([self._entries[n - self._dropped] for n in self._by_appt.get(appt_id, [])])
+
+    def between(self, start_ts: Optional[str] = None, end_ts: Optional[str] = None) -> List[Dict]:
+        """Messages with start_ts <= ts < end_ts (ISO strings); the log is in time order."""
+        with self._synced():
+            lo = bisect_left(self._ts, start_ts) if start_ts else 0
+            hi = bisect_left(self._ts, end_ts) if end_ts else len(self._ts)
+            return self._read(self._entries[lo:hi])
@@ -1,24 +1,155 @@
+import atexit
 import json
+import queue
+import threading
+import time
 from datetime import datetime
+from tools.message_log import MessageLog
+
+_STOP = object()
 
 class Messaging:
-    def __init__(self, log_path="data/messaging.log"):
+    def __init__(self, log_path="data/messaging.log", async_dispatch=False, queue_size=10000,
+                 flush_interval=0.5, batch_size=200, max_bytes=5_000_000, backup_count=5, max_age=None,
+                 write_retries=3):
+        """
+        The log itself is a rotating, indexed MessageLog (see tools/message_log.py);
+        max_bytes/backup_count/max_age control its rotation and self.log answers queries.
+
+        async_dispatch: hand messages to a background worker instead of writing them inline.
+        The worker writes up to batch_size messages per file open, waiting at most
+        flush_interval seconds to fill a batch. The queue is bounded by queue_size; when it
+        is full, senders block until the worker catches up (backpressure). close() drains it.
+        A batch whose write keeps failing after write_retries attempts is dropped (counted in
+        self.dropped, error in self.last_error) so the worker keeps running; if the worker is
+        gone anyway, sends fall back to inline writes and flush()/close() return.
+        """
         self.log_path = log_path
+        self.log = MessageLog(log_path, max_bytes=max_bytes, backup_count=backup_count, max_age=max_age)
+        self.async_dispatch = async_dispatch
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.write_retries = write_retries
+        self.dropped = 0
+        self.last_error = None
+        self._queue = None
+        self._worker = None
+        if async_dispatch:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._worker = threading.Thread(target=self._run, name="messaging", daemon=True)
+            self._worker.start()
+            atexit.register(self.close)
+
+    def _write(self, records):
+        self.log.append(records)
 
     def _log(self, payload):
-        line = json.dumps({"ts": datetime.utcnow().isoformat(), **payload})
-        with open(self.log_path, "a") as f:
-            f.write(line + "\n")
+        self._log_many([payload])
 
-    def send_confirmation(self, appointment):
-        payload = {
+    def _log_many(self, payloads):
+        ts = datetime.utcnow().isoformat()
+        records = [(ts, p.get("appt_id"), json.dumps({"ts": ts, **p})) for p in payloads]
+        for i, record in enumerate(records):
+            if not self._enqueue(record):
+                self._write(records[i:])
+                return
+
+    def _alive(self):
+        worker = self._worker
+        return worker is not None and worker.is_alive()
+
+    def _enqueue(self, record):
+        # False when there is no live worker to take the record
+        while self._alive():
+            try:
+                self._queue.put(record, timeout=self.flush_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _write_batch(self, batch):
+        for attempt in range(self.write_retries):
+            try:
+                self._write(batch)
+                return
+            except Exception as e:
+                self.last_error = e
+                time.sleep(min(1.0, 0.05 * 2 ** attempt))
+        self.dropped += len(batch)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            try:
+                if batch:
+                    self._write_batch(batch)
+            finally:
+                for _ in range(len(batch) + (1 if stopping else 0)):
+                    self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued message has been written."""
+        q = self._queue
+        if q is None:
+            return
+        with q.all_tasks_done:
+            while q.unfinished_tasks and self._alive():
+                q.all_tasks_done.wait(self.flush_interval)
+
+    def close(self):
+        """Drain the queue and stop the worker; later sends are written inline."""
+        worker = self._worker
+        if worker is None:
+            return
+        if self._enqueue(_STOP):
+            worker.join()
+        else:
+            # the worker died: write whatever it left behind ourselves
+            leftover = []
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    leftover.append(item)
+            if leftover:
+                self._write_batch(leftover)
+        self._worker = None
+        self._queue = None
+
+    @staticmethod
+    def _confirmation(appointment):
+        return {
             "type": "confirmation",
             "to_email": appointment.get("patient_email"),
             "to_phone": appointment.get("patient_phone"),
             "appt_id": appointment.get("appt_id"),
             "message": f"Confirmed: {appointment.get('doctor')} on {appointment.get('date')} {appointment.get('start')}",
         }
-        self._log(payload)
+
+    def send_confirmation(self, appointment):
+        self._log(self._confirmation(appointment))
+        return True
+
+    def send_confirmations(self, appointments):
+        """Confirm many appointments with one log write."""
+        self._log_many([self._confirmation(a) for a in appointments])
         return True
 
     def send_reminder(self, appointment, reminder_number=1):
@@ -1,13 +1,22 @@
 # tools/patient_db.py
 import pandas as pd
-import difflib
+import heapq
+import json
+import os
 import uuid
 import re
+import threading
 import unicodedata
+from collections import Counter, OrderedDict, defaultdict
 from datetime import datetime
-from typing import Tuple, Dict, Optional
+from typing import Tuple, Dict, Optional, List, Set
+from tools.file_lock import FileLock
+from tools.similarity import get_scorer
 
 PHONE_RE = re.compile(r"\D+")
+# default weights of the fuzzy score: name similarity vs. exact DOB match
+NAME_WEIGHT = 0.7
+DOB_WEIGHT = 0.3
 
 def _clean_text(s: Optional[str]) -> str:
     if s is None:
@@ -41,40 +50,299 @@ def _norm_dob(val) -> str:
         except Exception:
             return str(val)
 
+NORM_COLS = ["email_norm","phone_norm","name_norm","dob_norm"]
+
+def _as_text(col: pd.Series) -> pd.Series:
+    # same values .astype(str) gives an object column: missing -> "nan"
+    return col.fillna("nan").astype(str)
+
+def _clean_text_series(col: pd.Series) -> pd.Series:
+    """Vectorized _clean_text; only non-ASCII values take the per-row unicode path."""
+    col = _as_text(col)
+    out = (col.str.strip().str.lower()
+              .str.replace(r"[^\w\s]", " ", regex=True)
+              .str.replace(r"\s+", " ", regex=True)
+              .str.strip())
+    non_ascii = col.str.contains(r"[^\x00-\x7f]", regex=True)
+    if non_ascii.any():
+        out[non_ascii] = col[non_ascii].map(_clean_text)
+    return out
+
+def _norm_dob_series(col: pd.Series) -> pd.Series:
+    """Vectorized _norm_dob; ISO dates parse in one pass, anything else falls back per row."""
+    parsed = pd.to_datetime(col, errors="coerce", format="%Y-%m-%d")
+    out = parsed.dt.strftime("%Y-%m-%d").astype(object)
+    missed = parsed.isna()
+    if missed.any():
+        out[missed] = col[missed].map(_norm_dob)
+    return out
+
+def _norm_fields(row: Dict) -> Dict:
+    """Normalized helper values for a single row (incremental path)."""
+    return {
+        "email_norm": str(row.get("email", "")).strip().lower(),
+        "phone_norm": _norm_phone(str(row.get("phone", ""))),
+        "name_norm": _clean_text(str(row.get("name", ""))),
+        "dob_norm": _norm_dob(row.get("dob")),
+    }
+
+def _add_norm_columns(df: pd.DataFrame):
+    """Bulk (vectorized) normalization of a whole patient frame, in place."""
+    df["email_norm"] = _as_text(df["email"]).str.strip().str.lower()
+    df["phone_norm"] = _as_text(df["phone"]).str.replace(r"\D+", "", regex=True)
+    df["name_norm"] = _clean_text_series(df["name"])
+    df["dob_norm"] = _norm_dob_series(df["dob"])
+
+def _rank_candidates(name_q: str, dob_q: str, candidates, scorer, name_weight: float = NAME_WEIGHT,
+                     dob_weight: float = DOB_WEIGHT, top_k: int = 10):
+    """
+    One scoring pass over (key, name_norm, dob_norm) candidates in table order.
+    Returns (best_key, best_score, top): top is [(key, name_score, combined)] for the
+    top_k candidates, best first, ties in table order; best_key is the first
+    best-scoring candidate (None if nothing scores above 0).
+    """
+    top_k = max(1, top_k)
+    heap = []   # min-heap of (combined, -order, key, name_score): the best top_k so far
+    for order, (key, row_name, row_dob) in enumerate(candidates):
+        if not row_name and not name_q:
+            continue
+        dob_score = 1.0 if (dob_q and row_dob == dob_q) else 0.0
+        floor = heap[0][0] if len(heap) >= top_k else -1.0
+        if name_q:
+            # cheap upper bounds first, the ratio itself last; stop once the row cannot
+            # get into the top_k (a tie with the current k-th would rank after it anyway)
+            for name_score in scorer.bounds(name_q, row_name):
+                combined = name_weight * name_score + dob_weight * dob_score
+                if combined <= floor:
+                    break
+            else:
+                item = (combined, -order, key, name_score)
+                if len(heap) < top_k:
+                    heapq.heappush(heap, item)
+                else:
+                    heapq.heappushpop(heap, item)
+            continue
+        combined = dob_weight * dob_score
+        if combined > floor:
+            item = (combined, -order, key, 0.0)
+            if len(heap) < top_k:
+                heapq.heappush(heap, item)
+            else:
+                heapq.heappushpop(heap, item)
+    top = [(key, name_score, combined) for combined, _, key, name_score in heapq.nlargest(top_k, heap)]
+    if top and top[0][2] > 0.0:
+        return top[0][0], top[0][2], top
+    return None, 0.0, top
+
+def _name_grams(name_norm: str) -> Set[str]:
+    """Padded character trigrams used as blocking keys for the fuzzy stage."""
+    if not name_norm:
+        return set()
+    s = f" {name_norm} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
 class PatientDB:
-    def __init__(self, csv_path: str):
+    def __init__(self, csv_path: str, shortlist_size: int = 200, journal: bool = False,
+                 compact_every: int = 1000, scorer="auto", name_weight: float = NAME_WEIGHT,
+                 dob_weight: float = DOB_WEIGHT, rank_size: int = 10, cache_size: int = 256):
         self.csv_path = csv_path
+        # one instance can be shared by several threads (e.g. every app session):
+        # lookups and inserts on the indexes, table and ranking cache hold this lock
+        self._lock = threading.RLock()
+        # fuzzy stage: name similarity backend (see tools/similarity.py; "difflib"
+        # reproduces the original scores) and the name/DOB weights of the combined score
+        self.scorer = get_scorer(scorer)
+        self.name_weight = name_weight
+        self.dob_weight = dob_weight
+        # fuzzy rankings (best match + top rank_size candidates) per normalized (name, dob),
+        # least recently used evicted past cache_size; cleared whenever patients are added
+        self.rank_size = rank_size
+        self.cache_size = cache_size
+        self._rank_cache: "OrderedDict[Tuple[str, str], Tuple]" = OrderedDict()
+        # journal mode: new patients are appended to <csv>.journal and fsync'd instead of
+        # rewriting the CSV; compact() folds them into the CSV (also every compact_every records)
+        self.journal = journal
+        self.journal_path = csv_path + ".journal"
+        self.compact_every = compact_every
+        self._journal_len = 0
+        # other PatientDBs (a reloaded instance, another process) may share the files:
+        # journal appends and compactions run under this cross-process lock
+        self._flock = FileLock(csv_path + ".lock")
+        # max rows (besides the DOB bucket) handed to the fuzzy scorer
+        self.shortlist_size = shortlist_size
+        # rows created since the table was last materialized (see the df property)
+        self._tail: List[Dict] = []
         try:
-            self.df = pd.read_csv(csv_path, dtype=str)
+            self._base = pd.read_csv(csv_path, dtype=str)
         except Exception:
             cols = [
                 "patient_id","name","dob","gender","email","phone","address","city","state","zip",
                 "primary_insurer","member_id","group_no","preferred_doctor","is_returning","last_visit_date"
             ]
-            self.df = pd.DataFrame(columns=cols)
+            self._base = pd.DataFrame(columns=cols)
             self._save()
 
         # ensure columns exist
-        for c in ["email","phone","name","dob"]:
-            if c not in self.df.columns:
-                self.df[c] = ""
+        for c in ["patient_id","email","phone","name","dob"]:
+            if c not in self._base.columns:
+                self._base[c] = ""
 
         # build normalized helper columns
         self._refresh_norm_columns()
+        self._build_indexes()
+        self._replay_journal()
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """Full table; rows appended since the last access are folded in with one concat."""
+        with self._lock:
+            if self._tail:
+                self._base = pd.concat([self._base, pd.DataFrame(self._tail)], ignore_index=True)
+                self._tail = []
+            return self._base
+
+    def __len__(self):
+        return len(self._base) + len(self._tail)
 
     def _refresh_norm_columns(self):
-        self.df["email_norm"] = self.df["email"].astype(str).apply(lambda x: (x or "").strip().lower())
-        self.df["phone_norm"] = self.df["phone"].astype(str).apply(_norm_phone)
-        self.df["name_norm"] = self.df["name"].astype(str).apply(_clean_text)
-        self.df["dob_norm"] = self.df["dob"].apply(_norm_dob)
+        # bulk path for the initial load; create_patient normalizes only the new rows
+        _add_norm_columns(self.df)
+
+    def _row(self, pos: int) -> Dict:
+        with self._lock:
+            n = len(self._base)
+            if pos < n:
+                return self._base.iloc[pos].to_dict()
+            return dict(self._tail[pos - n])
+
+    def _build_indexes(self):
+        # exact-lookup maps: normalized email / phone / patient_id -> first row position
+        self._email_index: Dict[str, int] = {}
+        self._phone_index: Dict[str, int] = {}
+        self._id_index: Dict[str, int] = {}
+        # candidate-blocking index: name trigram -> row positions, dob -> row positions
+        self._gram_index: Dict[str, List[int]] = defaultdict(list)
+        self._dob_index: Dict[str, List[int]] = defaultdict(list)
+        # name_norm / dob_norm by row position, read by the fuzzy scorer
+        self._names: List[str] = []
+        self._dobs: List[str] = []
+        cols = zip(self.df["email_norm"], self.df["phone_norm"], self.df["patient_id"],
+                   self.df["name_norm"], self.df["dob_norm"])
+        for pos, (email_norm, phone_norm, patient_id, name_norm, dob_norm) in enumerate(cols):
+            self._index_row(pos, email_norm, phone_norm, patient_id, name_norm, dob_norm)
+
+    def _index_row(self, pos: int, email_norm, phone_norm, patient_id, name_norm, dob_norm):
+        # setdefault keeps the first row for duplicate keys, like rows.iloc[0] on a scan
+        self._email_index.setdefault(email_norm, pos)
+        self._phone_index.setdefault(phone_norm, pos)
+        self._id_index.setdefault(patient_id, pos)
+        self._names.append(name_norm)
+        self._dobs.append(str(dob_norm))
+        for g in _name_grams(str(name_norm or "")):
+            self._gram_index[g].append(pos)
+        dob_key = str(dob_norm)
+        if dob_key:
+            self._dob_index[dob_key].append(pos)
+
+    def _shortlist(self, name_q: str, dob_q: str) -> List[int]:
+        """Row positions worth scoring: the DOB bucket plus the rows sharing the most name trigrams."""
+        cands = set(self._dob_index.get(dob_q, ())) if dob_q else set()
+        overlap = Counter()
+        for g in _name_grams(name_q):
+            overlap.update(self._gram_index.get(g, ()))
+        cands.update(pos for pos, _ in overlap.most_common(self.shortlist_size))
+        # keep table order so ties resolve to the first row, as in a full scan
+        return sorted(cands)
 
     def _save(self):
-        # save original DataFrame (without helper cols)
+        # save original DataFrame (without helper cols); write a temp file and swap it in
+        # so a crash mid-write never leaves a truncated CSV behind
         save_df = self.df.copy()
-        for c in ["email_norm","phone_norm","name_norm","dob_norm"]:
+        for c in NORM_COLS:
             if c in save_df.columns:
                 save_df.drop(columns=[c], inplace=True)
-        save_df.to_csv(self.csv_path, index=False)
+        tmp_path = self.csv_path + ".tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            save_df.to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.csv_path)
+
+    def _read_journal(self) -> List[Dict]:
+        # call under self._flock; a torn last record (crash mid-write) is cut off
+        if not os.path.exists(self.journal_path):
+            return []
+        rows = []
+        good_end = 0
+        with open(self.journal_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    break
+                good_end += len(line)
+        if good_end < os.path.getsize(self.journal_path):
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good_end)
+        return rows
+
+    def _replay_journal(self):
+        """Re-apply journaled patients on startup."""
+        with self._lock, self._flock:
+            # rows already in the CSV were folded in by a compaction that crashed before truncating
+            rows = [r for r in self._read_journal() if r.get("patient_id") not in self._id_index]
+            self._append_rows(rows)
+            self._journal_len = len(rows)
+            if not self.journal and os.path.exists(self.journal_path):
+                self.compact()
+
+    def _catch_up(self):
+        # under self._flock: take in the patients other instances saved since we loaded
+        # (rows in the CSV or the journal we have no patient_id for), so saving our table
+        # can't drop them
+        rows = []
+        if os.path.exists(self.csv_path):
+            on_disk = pd.read_csv(self.csv_path, dtype=str)
+            if "patient_id" in on_disk.columns:
+                unseen = on_disk[~on_disk["patient_id"].isin(list(self._id_index))]
+                rows.extend(unseen.fillna("").to_dict("records"))
+        rows.extend(self._read_journal())
+        fresh = {}
+        for r in rows:
+            if r.get("patient_id") not in self._id_index:
+                fresh.setdefault(r.get("patient_id"), r)
+        self._append_rows(list(fresh.values()))
+
+    def _journal_append(self, new_rows: List[Dict]):
+        lines = "".join(json.dumps(r, default=str) + "\n" for r in new_rows)
+        with self._flock:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        self._journal_len += len(new_rows)
+        if self.compact_every and self._journal_len >= self.compact_every:
+            self.compact()
+
+    def _persist(self, new_rows: List[Dict]):
+        if self.journal:
+            self._journal_append(new_rows)
+        else:
+            self.compact()
+
+    def compact(self):
+        """
+        Fold journaled patients into the base CSV and empty the journal. Runs under the
+        file lock, after re-reading the CSV and journal for patients other instances saved.
+        """
+        with self._lock, self._flock:
+            self._catch_up()
+            self._save()
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self._journal_len = 0
 
     def _new_patient_dict(self, name, dob, phone, email, preferred_doctor=None) -> Dict:
         new = {
@@ -105,72 +373,126 @@ class PatientDB:
         - status: "returning" or "new"
         - score: 0.0..1.0 confidence
         """
-        name_q = _clean_text(name or "")
-        email_q = (email or "").strip().lower()
-        phone_q = _norm_phone(phone or "")
-        dob_q = _norm_dob(dob)
+        return self._match_normalized(name, dob, phone, email, _clean_text(name or ""), _norm_dob(dob),
+                                      _norm_phone(phone or ""), (email or "").strip().lower(), fuzzy_threshold)
 
-        # 1) exact email
-        if email_q:
-            rows = self.df[self.df["email_norm"] == email_q]
-            if not rows.empty:
-                return (rows.iloc[0].to_dict(), "returning", 1.0)
-
-        # 2) exact phone
-        if phone_q:
-            rows = self.df[self.df["phone_norm"] == phone_q]
-            if not rows.empty:
-                return (rows.iloc[0].to_dict(), "returning", 1.0)
-
-        # 3) fuzzy name with DOB boost
-        best = None
-        best_score = 0.0
-        for _, row in self.df.iterrows():
-            row_name = row.get("name_norm", "")
-            if not row_name and not name_q:
-                continue
-            name_score = difflib.SequenceMatcher(None, name_q, row_name).ratio() if name_q else 0.0
-            dob_score = 1.0 if (dob_q and str(row.get("dob_norm","")) == dob_q) else 0.0
-            combined = 0.7 * name_score + 0.3 * dob_score
-            if combined > best_score:
-                best_score = combined
-                best = row
-
-        if best is not None and best_score >= float(fuzzy_threshold):
-            return (best.to_dict(), "returning", round(float(best_score), 3))
-
-        # fallback -> new (return constructed dict)
-        return (self._new_patient_dict(name, dob, phone, email), "new", 0.0)
+    def match_patients(self, records: List[Dict], fuzzy_threshold: float = 0.65) -> List[Tuple[Dict, str, float]]:
+        """
+        match_patient for many records (name/dob/phone/email) at once: the queries are
+        normalized in one vectorized pass, then each is looked up in the indexes.
+        """
+        if not records:
+            return []
+        q = pd.DataFrame({c: [r.get(c) or "" for r in records] for c in ("name", "dob", "phone", "email")})
+        names = _clean_text_series(q["name"])
+        dobs = _norm_dob_series(q["dob"])
+        phones = q["phone"].astype(str).str.replace(r"\D+", "", regex=True)
+        emails = q["email"].astype(str).str.strip().str.lower()
+        return [
+            self._match_normalized(r.get("name"), r.get("dob"), r.get("phone"), r.get("email"),
+                                   name_q, dob_q, phone_q, email_q, fuzzy_threshold)
+            for r, name_q, dob_q, phone_q, email_q in zip(records, names, dobs, phones, emails)
+        ]
 
-    def debug_candidates(self, name: str, dob, top_k:int=10):
-        """Return top candidates with scores for inspection."""
-        name_q = _clean_text(name or "")
-        dob_q = _norm_dob(dob)
-        cands = []
-        for _, row in self.df.iterrows():
-            row_name = row.get("name_norm","")
-            name_score = difflib.SequenceMatcher(None, name_q, row_name).ratio() if name_q else 0.0
-            dob_score = 1.0 if (dob_q and str(row.get("dob_norm","")) == dob_q) else 0.0
-            combined = 0.7 * name_score + 0.3 * dob_score
-            cands.append({
+    def _match_normalized(self, name, dob, phone, email, name_q, dob_q, phone_q, email_q,
+                          fuzzy_threshold) -> Tuple[Dict, str, float]:
+        with self._lock:
+            # 1) exact email
+            if email_q:
+                pos = self._email_index.get(email_q)
+                if pos is not None:
+                    return (self._row(pos), "returning", 1.0)
+
+            # 2) exact phone
+            if phone_q:
+                pos = self._phone_index.get(phone_q)
+                if pos is not None:
+                    return (self._row(pos), "returning", 1.0)
+
+            # 3) fuzzy name with DOB boost, scored over the blocked shortlist only
+            best, best_score, _ = self._ranking(name_q, dob_q)
+
+            if best is not None and best_score >= float(fuzzy_threshold):
+                return (self._row(best), "returning", round(float(best_score), 3))
+
+            # fallback -> new (return constructed dict)
+            return (self._new_patient_dict(name, dob, phone, email), "new", 0.0)
+
+    def _ranking(self, name_q: str, dob_q: str, top_k: int = 0):
+        """(best_pos, best_score, top) for a normalized query, from the LRU cache when possible."""
+        with self._lock:
+            key = (name_q, dob_q)
+            hit = self._rank_cache.get(key)
+            if hit is not None and hit[0] >= top_k:
+                self._rank_cache.move_to_end(key)
+                return hit[1:]
+            k = max(top_k, self.rank_size)
+            cands = ((pos, self._names[pos], self._dobs[pos]) for pos in self._shortlist(name_q, dob_q))
+            ranked = _rank_candidates(name_q, dob_q, cands, self.scorer, self.name_weight, self.dob_weight, k)
+            self._rank_cache[key] = (k, *ranked)
+            self._rank_cache.move_to_end(key)
+            while len(self._rank_cache) > self.cache_size:
+                self._rank_cache.popitem(last=False)
+            return ranked
+
+    def _candidate_dicts(self, top, top_k):
+        out = []
+        for pos, name_score, combined in top[:top_k]:
+            row = self._row(pos)
+            out.append({
                 "patient_id": row.get("patient_id"),
                 "name": row.get("name"),
                 "dob_norm": row.get("dob_norm"),
                 "name_score": round(name_score,3),
                 "combined": round(combined,3)
             })
-        cands.sort(key=lambda x: x["combined"], reverse=True)
-        return cands[:top_k]
+        return out
+
+    def debug_candidates(self, name: str, dob, top_k:int=10):
+        """Return top candidates (from the blocked shortlist) with scores for inspection."""
+        name_q = _clean_text(name or "")
+        dob_q = _norm_dob(dob)
+        return self._candidate_dicts(self._ranking(name_q, dob_q, top_k)[2], top_k)
+
+    def match_with_candidates(self, name: str, dob, phone: Optional[str]=None, email: Optional[str]=None,
+                              top_k: int = 5, fuzzy_threshold: float = 0.65):
+        """match_patient plus debug_candidates from a single ranking pass:
+        (patient_dict, status, score, candidates)."""
+        name_q, dob_q = _clean_text(name or ""), _norm_dob(dob)
+        patient, status, score = self._match_normalized(name, dob, phone, email, name_q, dob_q,
+                                                        _norm_phone(phone or ""), (email or "").strip().lower(),
+                                                        fuzzy_threshold)
+        return patient, status, score, self._candidate_dicts(self._ranking(name_q, dob_q, top_k)[2], top_k)
+
+    def _append_rows(self, new_rows: List[Dict]):
+        # normalize and index only the inserted rows; the frame itself grows lazily
+        self._rank_cache.clear()   # a new row can change any cached ranking
+        for new_row in new_rows:
+            row = {**new_row, **_norm_fields(new_row)}
+            pos = len(self)
+            self._tail.append(row)
+            self._index_row(pos, row["email_norm"], row["phone_norm"], row["patient_id"],
+                            row["name_norm"], row["dob_norm"])
 
     def create_patient(self, name, dob, phone, email, preferred_doctor):
         new_row = self._new_patient_dict(name, dob, phone, email, preferred_doctor)
-        # append to df
-        self.df = pd.concat([self.df, pd.DataFrame([new_row])], ignore_index=True)
-        # refresh helper columns and save
-        self._refresh_norm_columns()
-        self._save()
+        with self._lock:
+            self._append_rows([new_row])
+            self._persist([new_row])
         return new_row
 
+    def create_patients(self, records: List[Dict]) -> List[Dict]:
+        """Register many patients with a single save. records hold name/dob/phone/email/preferred_doctor."""
+        new_rows = [
+            self._new_patient_dict(r.get("name"), r.get("dob"), r.get("phone"), r.get("email"),
+                                   r.get("preferred_doctor"))
+            for r in records
+        ]
+        with self._lock:
+            self._append_rows(new_rows)
+            self._persist(new_rows)
+        return new_rows
+
     def get_patient(self, patient_id: str) -> Optional[Dict]:
-        r = self.df[self.df.get("patient_id","") == patient_id]
-        return r.iloc[0].to_dict() if not r.empty else None
+        pos = self._id_index.get(patient_id)
+        return self._row(pos) if pos is not None else None
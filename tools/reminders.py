@@ -0,0 +1,120 @@
+import heapq
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# seconds after booking at which reminders 1, 2, 3 are due (demo timings)
+DEFAULT_OFFSETS = (10, 20, 30)
+
+class ReminderScheduler:
+    """
+    Min-heap of (due_time, appt_id, reminder_no). run_due() pops only what is due, so a
+    tick costs O(k log n) for k due reminders instead of a scan of every appointment.
+    start() runs the same loop on a daemon thread that sleeps until the next due time.
+    State is not persisted here; rebuild() restores the heap from the appointment records
+    (created_at + reminder1..3 columns) after a restart.
+    A reminder whose fire() raises (e.g. "database is locked") is queued again
+    retry_seconds * attempts later; after max_attempts it is given up on (counted in
+    self.failed, error in self.last_error). Either way the other due reminders still
+    fire and the background loop keeps running.
+    """
+    def __init__(self, fire: Callable[[str, int, datetime], None], offsets=DEFAULT_OFFSETS, poll_seconds=5.0,
+                 retry_seconds=5.0, max_attempts=5):
+        self.fire = fire
+        self.offsets = tuple(offsets)
+        self.poll_seconds = poll_seconds
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+        self.failed = 0
+        self.last_error = None
+        self._attempts: Dict[Tuple[str, int], int] = {}   # (appt_id, reminder_no) -> failed fires
+        self._heap: List[Tuple[datetime, str, int]] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _pending(self, appt: Dict) -> List[Tuple[datetime, str, int]]:
+        created_at = datetime.fromisoformat(appt["created_at"])
+        return [
+            (created_at + timedelta(seconds=off), appt["appt_id"], n)
+            for n, off in enumerate(self.offsets, start=1)
+            if not appt.get(f"reminder{n}")
+        ]
+
+    def schedule(self, appt: Dict):
+        """Queue the reminders this appointment has not had yet."""
+        with self._cond:
+            for item in self._pending(appt):
+                heapq.heappush(self._heap, item)
+            self._cond.notify()
+
+    def rebuild(self, appointments: Iterable[Dict]):
+        with self._cond:
+            self._heap = [item for appt in appointments for item in self._pending(appt)]
+            heapq.heapify(self._heap)
+            self._attempts = {}
+            self._cond.notify()
+
+    def run_due(self, now: Optional[datetime] = None) -> int:
+        """Fire every reminder due at or before now; return how many fired."""
+        now = now or datetime.utcnow()
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+        fired = 0
+        for _, appt_id, n in due:
+            try:
+                self.fire(appt_id, n, now)
+            except Exception as e:
+                self._retry(appt_id, n, now, e)
+                continue
+            fired += 1
+            if self._attempts:
+                with self._cond:
+                    self._attempts.pop((appt_id, n), None)
+        return fired
+
+    def _retry(self, appt_id, n, now, error):
+        # back on the heap with a growing delay, or dropped after max_attempts
+        with self._cond:
+            self.last_error = error
+            attempts = self._attempts.pop((appt_id, n), 0) + 1
+            if attempts >= self.max_attempts:
+                self.failed += 1
+                return
+            self._attempts[(appt_id, n)] = attempts
+            heapq.heappush(self._heap, (now + timedelta(seconds=self.retry_seconds * attempts), appt_id, n))
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                delay = (self._heap[0][0] - datetime.utcnow()).total_seconds() if self._heap else None
+                if delay is None or delay > 0:
+                    self._cond.wait(min(delay, self.poll_seconds) if delay is not None else self.poll_seconds)
+                    continue
+            try:
+                self.run_due()
+            except Exception as e:
+                # fire() errors are handled in run_due; anything else must not end the loop
+                self.last_error = e
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="reminders", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
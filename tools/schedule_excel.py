@@ -1,71 +1,300 @@
+import heapq
+import os
+import shutil
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
 import pandas as pd
+from contextlib import contextmanager
 from datetime import datetime, date
-from openpyxl import load_workbook
 import copy
+from itertools import islice
+from tools.file_lock import FileLock
+from tools.slot_index import BOOKED, SlotIndex
+
+_SHEET_TAG = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheet"
+
+def _sheet_names(xlsx_path):
+    """Worksheet names in workbook order, read from xl/workbook.xml without parsing any sheet."""
+    with zipfile.ZipFile(xlsx_path) as zf:
+        root = ET.fromstring(zf.read("xl/workbook.xml"))
+    return [el.get("name") for el in root.iter(_SHEET_TAG)]
 
 class ScheduleExcel:
-    def __init__(self, xlsx_path):
+    def __init__(self, xlsx_path, autoflush=True):
         self.xlsx_path = xlsx_path
+        # autoflush: write dirty sheets back at the end of every book_slot; otherwise call
+        # flush(). Unflushed bookings are only safe against other processes inside batch().
+        self.autoflush = autoflush
+        self._names = []       # every doctor (sheet) in the workbook, in order
+        self._sheets = {}      # doctor -> parsed sheet DataFrame, for sheets accessed so far
+        self._index = {}       # doctor -> SlotIndex (columnar slots) over that sheet
+        self._dirty = set()    # doctors whose in-memory sheet differs from the file
+        self._stamp = None     # (mtime_ns, size) of the file the cache was parsed from
+        # cross-process lock around every claim; its generation counter tells us
+        # whether another process committed since we parsed the workbook
+        self._lock = FileLock(xlsx_path + ".lock")
+        # in-process guard for the cached sheets and indexes: one instance is shared by
+        # every session, so reads must not run while another thread reloads or claims
+        self._mutex = threading.RLock()
+        self._generation = 0
+        self._batch_depth = 0
         self._load()
 
+    def _file_stamp(self):
+        st = os.stat(self.xlsx_path)
+        return (st.st_mtime_ns, st.st_size)
+
     def _load(self):
-        self.book = load_workbook(self.xlsx_path)
-        # No in-memory caching of sheets as dataframes; read on demand
+        # only the sheet names are read here; each sheet is parsed on first access
+        # (_sheet) and served from memory until the file changes on disk
+        self._generation = self._lock.generation()
+        self._stamp = self._file_stamp()
+        self._names = _sheet_names(self.xlsx_path)
+        self._sheets = {}
+        self._index = {}
+        self._dirty = set()
+
+    def _read_sheet(self, doctor):
+        # one sheet, streamed (pandas' openpyxl reader opens the workbook read-only)
+        df = pd.read_excel(self.xlsx_path, sheet_name=doctor, parse_dates=["date"])
+        self._prepare_sheet(df)
+        return df
+
+    @staticmethod
+    def _prepare_sheet(df):
+        # per-slot version for compare-and-swap claims; patient_id holds ids, not floats
+        if "version" not in df.columns:
+            df["version"] = 0
+        df["version"] = df["version"].fillna(0).astype(int)
+        if "patient_id" not in df.columns:
+            df["patient_id"] = ""
+        df["patient_id"] = df["patient_id"].astype(object)
+
+    def _sync_locked(self):
+        # under the lock: reload if another process committed since our last parse
+        if self._lock.generation() != self._generation:
+            self._load()
+
+    def _ensure_fresh(self):
+        # someone else rewrote the workbook: re-parse, unless we hold unflushed bookings
+        if not self._dirty and self._file_stamp() != self._stamp:
+            self._load()
+
+    def _sheet(self, doctor):
+        with self._mutex:
+            self._ensure_fresh()
+            if doctor not in self._sheets:
+                if doctor not in self._names:
+                    raise ValueError(f"Worksheet named '{doctor}' not found")
+                self._sheets[doctor] = self._read_sheet(doctor)
+            return self._sheets[doctor]
+
+    def _slot_index(self, doctor):
+        with self._mutex:
+            df = self._sheet(doctor)
+            if doctor not in self._index:
+                self._index[doctor] = SlotIndex(df)
+            return self._index[doctor]
+
+    @staticmethod
+    def _slot_dict(d, entry):
+        return {
+            "date": d,
+            "start_time": entry[3],
+            "end_time": entry[4],
+            "slot_length": entry[5],
+            "version": entry[6]
+        }
+
+    @staticmethod
+    def _span_dict(d, span):
+        # one bookable slot covering back-to-back rows; book_slot resolves it by start/end
+        return {
+            "date": d,
+            "start_time": span[0][3],
+            "end_time": span[-1][4],
+            "slot_length": sum(e[5] for e in span),
+            # versions only ever go up, so their sum changes whenever any row does
+            "version": sum(e[6] for e in span)
+        }
+
+    @staticmethod
+    def _with_utilization(usage):
+        # booked share of the bookable (free + booked) minutes; 0 on days with none
+        total = usage["free_minutes"] + usage["booked_minutes"]
+        usage["utilization"] = (usage["booked_minutes"] / total.where(total > 0)).fillna(0.0).astype(float)
+        return usage
 
     def list_doctors(self):
-        return self.book.sheetnames
+        with self._mutex:
+            self._ensure_fresh()
+            return list(self._names)
 
     def upcoming_days(self, n=7):
         base = date.today()
         return [(base + pd.Timedelta(days=i)).isoformat() for i in range(n)]
 
     def available_slots(self, doctor, target_date_iso):
-        df = pd.read_excel(self.xlsx_path, sheet_name=doctor, parse_dates=["date"])
         target = pd.to_datetime(target_date_iso).date()
-        rows = df[df['date'].dt.date == target]
-        avail = rows[rows['status'].str.lower()=="available"]
-        out = []
-        for _, r in avail.iterrows():
-            out.append({
-                "date": r['date'].date(),
-                "start_time": r['start_time'],
-                "end_time": r['end_time'],
-                "slot_length": int(r['slot_length'])
-            })
-        return out
-
-    def find_slots(self, doctor, required_minutes):
-        """Return list of slot dicts available (first-fit)"""
-        df = pd.read_excel(self.xlsx_path, sheet_name=doctor, parse_dates=["date"])
-        # iterate across dates ascending
-        df = df.sort_values(["date","start_time"])
-        slots = []
-        for _, r in df.iterrows():
-            if str(r['status']).lower() != "available":
-                continue
-            if int(r['slot_length']) >= required_minutes:
-                slots.append({
-                    "date": r['date'].date(),
-                    "start_time": r['start_time'],
-                    "end_time": r['end_time'],
-                    "slot_length": int(r['slot_length'])
-                })
-        return slots
-
-    def book_slot(self, doctor, slot):
-        """Mark the first matching slot as Booked and save workbook. Return True/False."""
-        df = pd.read_excel(self.xlsx_path, sheet_name=doctor, parse_dates=["date"])
-        mask = (
-            (df['date'].dt.date == slot['date']) &
-            (df['start_time'] == slot['start_time']) &
-            (df['end_time'] == slot['end_time'])
-        )
-        if mask.sum() == 0:
-            return False
-        if df.loc[mask, 'status'].iloc[0].lower() != "available":
-            return False
-        df.loc[mask, 'status'] = "Booked"
-        # write back to excel safely
-        with pd.ExcelWriter(self.xlsx_path, engine="openpyxl", mode="a", if_sheet_exists="overlay") as writer:
-            df.to_excel(writer, sheet_name=doctor, index=False)
-        return True
+        with self._mutex:
+            return [self._slot_dict(target, e) for e in self._slot_index(doctor).day(target)]
+
+    def find_slots(self, doctor, required_minutes, from_date=None, limit=None, to_date=None):
+        """Return list of slot dicts available (first-fit), in date/start order.
+        Adjacent free rows are merged when no single row is long enough, so a 60m visit
+        can take two back-to-back 30m slots. from_date/to_date bound the days searched;
+        limit stops the scan after that many slots."""
+        if from_date is not None:
+            from_date = pd.to_datetime(from_date).date()
+        if to_date is not None:
+            to_date = pd.to_datetime(to_date).date()
+        with self._mutex:
+            found = self._slot_index(doctor).iter_free(from_date, required_minutes, to_date)
+            return [self._span_dict(d, span) for d, span in islice(found, limit)]
+
+    def find_slots_any(self, required_minutes, from_date=None, limit=None, to_date=None,
+                       location=None, doctors=None):
+        """Clinic-wide earliest-available search: find_slots over every doctor (or just
+        `doctors`), merged into one (date, start) order with a k-way heap; ties go to the
+        doctor listed first. Each slot dict also names its doctor and location. location
+        keeps only the slots at that site. All doctors are searched in the in-memory
+        sheets, and each doctor's search only runs as far as the merge needs it."""
+        if from_date is not None:
+            from_date = pd.to_datetime(from_date).date()
+        if to_date is not None:
+            to_date = pd.to_datetime(to_date).date()
+        def spans(doctor):
+            index = self._slot_index(doctor)
+            for d, span in index.iter_free(from_date, required_minutes, to_date, location):
+                slot = self._span_dict(d, span)
+                slot["doctor"] = doctor
+                slot["location"] = index.location_of(span[0][2])
+                yield (d, span[0][0]), slot
+        with self._mutex:
+            doctors = self.list_doctors() if doctors is None else doctors
+            merged = heapq.merge(*(spans(doc) for doc in doctors), key=lambda item: item[0])
+            return [slot for _, slot in islice(merged, limit)]
+
+    def list_locations(self):
+        """Every location named in the schedules (parses all sheets)."""
+        names = {}
+        with self._mutex:
+            for doctor in self.list_doctors():
+                names.update(dict.fromkeys(self._slot_index(doctor).location_names))
+        return list(names)
+
+    def book_slot(self, doctor, slot, patient_id=None):
+        """
+        Mark the free row(s) covering the slot as Booked and write them back. Return True/False.
+        The claim runs under a cross-process file lock against freshly synced state, so two
+        processes can never both win the same row. A slot spanning several back-to-back rows
+        is booked all-or-nothing. If the slot dict carries a "version" (as returned by
+        find_slots/available_slots), the claim also fails when any row changed since then.
+        """
+        with self._lock, self._mutex:
+            self._sync_locked()
+            df = self._sheet(doctor)
+            index = self._slot_index(doctor)
+            d = pd.to_datetime(slot['date']).date()
+            span = index.find_span(d, slot['start_time'], slot['end_time'])
+            if span is None:
+                return False
+            if slot.get("version") is not None and sum(e[6] for e in span) != slot["version"]:
+                return False
+            status_col = df.columns.get_loc('status')
+            version_col = df.columns.get_loc('version')
+            pid_col = df.columns.get_loc('patient_id')
+            for entry in span:
+                pos = entry[2]
+                df.iat[pos, status_col] = "Booked"
+                df.iat[pos, version_col] = entry[6] + 1
+                if patient_id is not None:
+                    df.iat[pos, pid_col] = patient_id
+                index.remove(d, pos)
+            self._dirty.add(doctor)
+            if self.autoflush and not self._batch_depth:
+                self.flush()
+            return True
+
+    def release_slot(self, doctor, slot, patient_id=None):
+        """
+        Cancellation: mark the booked row(s) covering the slot Available again (new
+        version, patient_id cleared) and write them back. Return True/False. With
+        patient_id, rows booked for someone else are left alone.
+        """
+        with self._lock, self._mutex:
+            self._sync_locked()
+            df = self._sheet(doctor)
+            index = self._slot_index(doctor)
+            d = pd.to_datetime(slot['date']).date()
+            span = index.find_span(d, slot['start_time'], slot['end_time'], status=BOOKED)
+            if span is None:
+                return False
+            status_col = df.columns.get_loc('status')
+            version_col = df.columns.get_loc('version')
+            pid_col = df.columns.get_loc('patient_id')
+            if patient_id is not None and any(str(df.iat[e[2], pid_col]) != str(patient_id) for e in span):
+                return False
+            for entry in span:
+                pos = entry[2]
+                version = int(df.iat[pos, version_col]) + 1
+                df.iat[pos, status_col] = "Available"
+                df.iat[pos, version_col] = version
+                df.iat[pos, pid_col] = ""
+                index.add(d, pos, entry[3], entry[4], entry[5], version)
+            self._dirty.add(doctor)
+            if self.autoflush and not self._batch_depth:
+                self.flush()
+            return True
+
+    def utilization(self, from_date=None, to_date=None, doctors=None):
+        """
+        Free and booked minutes per doctor and day, read from the per-day aggregates the
+        slot indexes keep current on every booking and release (no sheet scan). Returns
+        a DataFrame: doctor, date, free_minutes, booked_minutes, utilization (booked share).
+        """
+        if from_date is not None:
+            from_date = pd.to_datetime(from_date).date()
+        if to_date is not None:
+            to_date = pd.to_datetime(to_date).date()
+        parts = []
+        with self._mutex:
+            # usage() returns views of the live aggregates: copy them out under the lock
+            for doctor in (self.list_doctors() if doctors is None else doctors):
+                days, free, booked = self._slot_index(doctor).usage(from_date, to_date)
+                parts.append(pd.DataFrame({"doctor": doctor, "date": [date.fromordinal(int(o)) for o in days],
+                                           "free_minutes": free.copy(), "booked_minutes": booked.copy()}))
+        return self._with_utilization(pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+            columns=["doctor", "date", "free_minutes", "booked_minutes"]))
+
+    @contextmanager
+    def batch(self):
+        """Hold the lock across many book_slot calls and write the workbook once at the end."""
+        with self._lock:
+            with self._mutex:
+                self._sync_locked()
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self.flush()
+
+    def flush(self):
+        """Write dirty sheets back to the workbook (other sheets are left untouched).
+        The new workbook is written to a temp copy and swapped in, so readers never see
+        a half-written file."""
+        if not self._dirty:
+            return
+        with self._lock, self._mutex:
+            tmp_path = self.xlsx_path + ".tmp.xlsx"
+            shutil.copyfile(self.xlsx_path, tmp_path)
+            with pd.ExcelWriter(tmp_path, engine="openpyxl", mode="a", if_sheet_exists="overlay") as writer:
+                for doctor in sorted(self._dirty):
+                    self._sheets[doctor].to_excel(writer, sheet_name=doctor, index=False)
+            os.replace(tmp_path, self.xlsx_path)
+            self._dirty = set()
+            self._stamp = self._file_stamp()
+            self._generation = self._lock.bump_generation()
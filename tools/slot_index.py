@@ -0,0 +1,277 @@
+from datetime import date
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# one free slot: (start_minute, end_minute, row_position, start_time, end_time, slot_length, version)
+Entry = Tuple[int, int, int, object, object, int, int]
+
+def _to_minutes(t) -> int:
+    """'09:30' (or a datetime.time cell) -> minutes since midnight."""
+    if hasattr(t, "hour"):
+        return t.hour * 60 + t.minute
+    hh, mm = str(t).strip().split(":")[:2]
+    return int(hh) * 60 + int(mm)
+
+def _hhmm(m) -> str:
+    return f"{m // 60:02d}:{m % 60:02d}"
+
+_HHMM = [_hhmm(m) for m in range(24 * 60 + 1)]
+
+# row status bits of the columnar index
+FREE, BOOKED, OTHER = 1, 2, 4
+# site of rows in sheets without a location column
+DEFAULT_LOCATION = "Main Clinic"
+_EPOCH = date(1970, 1, 1).toordinal()
+
+def _minutes_or_missing(t) -> int:
+    try:
+        return _to_minutes(t)
+    except (TypeError, ValueError):
+        return -1
+
+def runs(entries: List[Entry]) -> List[List[Entry]]:
+    """Group one day's free entries (sorted by start) into runs of back-to-back rows."""
+    out: List[List[Entry]] = []
+    for e in entries:
+        if out and out[-1][-1][1] == e[0]:
+            out[-1].append(e)
+        else:
+            out.append([e])
+    return out
+
+def find_span(entries: List[Entry], start, end) -> Optional[List[Entry]]:
+    """The back-to-back free entries covering start..end exactly, or None if any is taken."""
+    for run in runs(entries):
+        for i, e in enumerate(run):
+            if e[3] != start:
+                continue
+            for j in range(i, len(run)):
+                if run[j][4] == end:
+                    return run[i:j + 1]
+            return None
+    return None
+
+def day_spans(entries: List[Entry], min_minutes: int):
+    """
+    Yield the bookable spans of one day's free entries, in start order. A span is the
+    shortest list of back-to-back rows, starting at each free row, whose lengths add up
+    to min_minutes; a single long-enough row is a span of one. Spans that still cover
+    min_minutes without their first row are not offered.
+    """
+    for run in runs(entries):
+        for k in range(len(run)):
+            total = 0
+            for j in range(k, len(run)):
+                total += run[j][5]
+                if total >= min_minutes:
+                    # skip spans that would still be long enough without their
+                    # first row; those would book more time than the visit needs
+                    if total - run[k][5] < min_minutes:
+                        yield run[k:j + 1]
+                    break
+
+class SlotIndex:
+    """
+    Slot index for one doctor sheet, stored as columns: int32 day ordinal, start/end
+    minute of day, slot length, version, sheet row and location code, plus a status
+    bitmask (FREE / BOOKED / OTHER), all sorted by (day, start). Searches are NumPy
+    range/mask operations over these arrays; only the slots returned are turned back
+    into Entry tuples (times as "HH:MM"). Booking flips a row's status bit instead of
+    moving data. Free and booked minutes per day are kept alongside (usage()), updated
+    by every remove/add rather than recomputed.
+    """
+    def __init__(self, df):
+        n = len(df)
+        dates = pd.to_datetime(pd.Series(df["date"]), errors="coerce")
+        ok = dates.notna().to_numpy()
+        rows = np.flatnonzero(ok)
+        day = dates.to_numpy()[ok].astype("datetime64[D]").astype(np.int64) + _EPOCH
+        start = np.array([_minutes_or_missing(t) for t in df["start_time"].to_numpy()[ok]], dtype=np.int32)
+        end = np.array([_minutes_or_missing(t) for t in df["end_time"].to_numpy()[ok]], dtype=np.int32)
+        length = pd.to_numeric(df["slot_length"], errors="coerce").fillna(0).to_numpy()[ok]
+        version = (pd.to_numeric(df["version"], errors="coerce").fillna(0).to_numpy()[ok]
+                   if "version" in df.columns else np.zeros(len(rows)))
+        status = df["status"].astype(str).str.lower().to_numpy()[ok]
+        bits = np.where(status == "available", FREE, np.where(status == "booked", BOOKED, OTHER))
+        bits[(bits == FREE) & ((start < 0) | (end < 0))] = OTHER
+        if "location" in df.columns:
+            sites = df["location"].where(df["location"].notna(), DEFAULT_LOCATION).astype(str).str.strip()
+        else:
+            sites = pd.Series(DEFAULT_LOCATION, index=df.index)
+        location, names = pd.factorize(sites.to_numpy()[ok])
+        self.location_names = list(names)
+
+        order = np.lexsort((rows, end, start, day))
+        self.days = day[order].astype(np.int32)
+        self.starts = start[order]
+        self.ends = end[order]
+        self.lengths = length[order].astype(np.int32)
+        self.versions = version[order].astype(np.int32)
+        self.rows = rows[order].astype(np.int32)
+        self.status = bits[order].astype(np.uint8)
+        self.locations = location[order].astype(np.int16)
+        # sheet row -> position in the columns (-1: row has no date)
+        self._at = np.full(n, -1, dtype=np.int32)
+        self._at[self.rows] = np.arange(len(self.rows), dtype=np.int32)
+        # per-day aggregates: sorted day ordinals with their free / booked minutes
+        self.usage_days, bucket = np.unique(self.days, return_inverse=True)
+        self.free_minutes = np.bincount(bucket, self.lengths * (self.status == FREE),
+                                        len(self.usage_days)).astype(np.int32)
+        self.booked_minutes = np.bincount(bucket, self.lengths * (self.status == BOOKED),
+                                          len(self.usage_days)).astype(np.int32)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _entries(self, idx) -> List[Entry]:
+        """Entry tuples for column positions idx (the conversion back at the API boundary)."""
+        cols = [self.starts[idx].tolist(), self.ends[idx].tolist(), self.rows[idx].tolist(),
+                self.lengths[idx].tolist(), self.versions[idx].tolist()]
+        return [(s, e, r, _HHMM[s] if s < len(_HHMM) else _hhmm(s), _HHMM[e] if e < len(_HHMM) else _hhmm(e), n, v)
+                for s, e, r, n, v in zip(*cols)]
+
+    def _free(self, from_date: Optional[date] = None, to_date: Optional[date] = None,
+              location: Optional[str] = None, status: int = FREE) -> np.ndarray:
+        """
+        Column positions of the free slots (or those with another status bit) between
+        from_date and to_date, at one location if given, in (day, start) order.
+        """
+        lo = np.searchsorted(self.days, from_date.toordinal(), "left") if from_date else 0
+        hi = np.searchsorted(self.days, to_date.toordinal(), "right") if to_date else len(self.days)
+        free = (self.status[lo:hi] & status).astype(bool)
+        if location is not None:
+            if location not in self.location_names:
+                return np.empty(0, dtype=np.int64)
+            free &= self.locations[lo:hi] == self.location_names.index(location)
+        return lo + np.flatnonzero(free)
+
+    def _location_code(self, location: str) -> int:
+        if location not in self.location_names:
+            self.location_names.append(location)
+        return self.location_names.index(location)
+
+    def location_of(self, pos: int) -> str:
+        """Location of a sheet row."""
+        i = self._find(pos)
+        return self.location_names[self.locations[i]] if i >= 0 else DEFAULT_LOCATION
+
+    def _find(self, pos: int) -> int:
+        return int(self._at[pos]) if 0 <= pos < len(self._at) else -1
+
+    def _count(self, i: int, sign: int):
+        # add (sign=1) or take back (sign=-1) row i's minutes in its day's aggregate
+        if not self.status[i] & (FREE | BOOKED):
+            return
+        k = int(np.searchsorted(self.usage_days, self.days[i]))
+        if k == len(self.usage_days) or self.usage_days[k] != self.days[i]:
+            self.usage_days = np.insert(self.usage_days, k, self.days[i])
+            self.free_minutes = np.insert(self.free_minutes, k, 0)
+            self.booked_minutes = np.insert(self.booked_minutes, k, 0)
+        minutes = self.free_minutes if self.status[i] & FREE else self.booked_minutes
+        minutes[k] += sign * int(self.lengths[i])
+
+    def usage(self, from_date: Optional[date] = None, to_date: Optional[date] = None):
+        """(day ordinals, free minutes, booked minutes) for the days between from_date and to_date."""
+        lo = np.searchsorted(self.usage_days, from_date.toordinal(), "left") if from_date else 0
+        hi = np.searchsorted(self.usage_days, to_date.toordinal(), "right") if to_date else len(self.usage_days)
+        return self.usage_days[lo:hi], self.free_minutes[lo:hi], self.booked_minutes[lo:hi]
+
+    def add(self, d: date, pos: int, start, end, length: int, version: int = 0, location: Optional[str] = None):
+        """Mark a sheet row free (again), with its current times, length and version."""
+        i = self._find(pos)
+        s, e = _to_minutes(start), _to_minutes(end)
+        if location is not None:
+            site = self._location_code(location)
+        else:
+            site = self.locations[i] if i >= 0 else self._location_code(DEFAULT_LOCATION)
+        if i >= 0:
+            self._count(i, -1)
+        if i >= 0 and (self.days[i], self.starts[i], self.ends[i]) == (d.toordinal(), s, e):
+            self.lengths[i], self.versions[i], self.status[i], self.locations[i] = length, version, FREE, site
+            self._count(i, 1)
+            return
+        if i >= 0:
+            keep = np.arange(len(self.rows)) != i
+            for name in ("days", "starts", "ends", "lengths", "versions", "rows", "status", "locations"):
+                setattr(self, name, getattr(self, name)[keep])
+        # insert after every column entry that sorts before (day, start, end, row)
+        key = (d.toordinal(), s, e, pos)
+        at = int(np.count_nonzero(
+            (self.days < key[0]) | ((self.days == key[0]) & ((self.starts < s) | ((self.starts == s) & (
+                (self.ends < e) | ((self.ends == e) & (self.rows < pos))))))))
+        for name, value in (("days", key[0]), ("starts", s), ("ends", e), ("lengths", length),
+                            ("versions", version), ("rows", pos), ("status", FREE), ("locations", site)):
+            setattr(self, name, np.insert(getattr(self, name), at, value))
+        if pos >= len(self._at):
+            self._at = np.concatenate([self._at, np.full(pos + 1 - len(self._at), -1, dtype=np.int32)])
+        self._at[:] = -1
+        self._at[self.rows] = np.arange(len(self.rows), dtype=np.int32)
+        self._count(at, 1)
+
+    def remove(self, d: date, pos: int):
+        """Mark a sheet row booked."""
+        i = self._find(pos)
+        if i >= 0 and self.days[i] == d.toordinal():
+            self._count(i, -1)
+            self.status[i] = BOOKED
+            self._count(i, 1)
+
+    def day(self, d: date) -> List[Entry]:
+        """Free slots on one date, ordered by start time."""
+        return self._entries(self._free(d, d))
+
+    def runs(self, d: date) -> List[List[Entry]]:
+        """Free slots on one date grouped into runs of back-to-back rows."""
+        return runs(self.day(d))
+
+    def find_span(self, d: date, start, end, status: int = FREE) -> Optional[List[Entry]]:
+        """
+        The back-to-back free rows covering start..end exactly, or None if any is taken.
+        status=BOOKED finds booked rows instead (to release them).
+        """
+        idx = self._free(d, d, status=status)
+        s, e = _to_minutes(start), _to_minutes(end)
+        first = np.flatnonzero(self.starts[idx] == s)
+        if not len(first):
+            return None
+        k = first[0]
+        # the run of back-to-back rows from k; the span ends at the first row ending at `end`
+        breaks = np.flatnonzero(self.ends[idx[k:-1]] != self.starts[idx[k + 1:]])
+        last = k + (breaks[0] if len(breaks) else len(idx) - 1 - k)
+        hit = np.flatnonzero(self.ends[idx[k:last + 1]] == e)
+        if not len(hit):
+            return None
+        return self._entries(idx[k:k + hit[0] + 1])
+
+    def iter_free(self, from_date: Optional[date] = None, min_minutes: int = 0,
+                  to_date: Optional[date] = None, location: Optional[str] = None):
+        """
+        Yield (date, span) in (date, start) order between from_date and to_date (see
+        day_spans). location keeps only that site's rows.
+        """
+        idx = self._free(from_date, to_date, location)
+        n = len(idx)
+        if not n:
+            return
+        day, start, end = self.days[idx], self.starts[idx], self.ends[idx]
+        length = self.lengths[idx].astype(np.int64)
+        # runs of back-to-back free rows, then for each row k the first row j of its run
+        # where the lengths from k add up to min_minutes (prefix sums + searchsorted)
+        run = np.cumsum(np.r_[True, (day[1:] != day[:-1]) | (end[:-1] != start[1:])])
+        total = np.cumsum(length)
+        before = total - length
+        j = np.maximum(np.searchsorted(total, before + min_minutes, "left"), np.arange(n))
+        jc = np.minimum(j, n - 1)
+        ok = (j < n) & (run[jc] == run)
+        # skip spans that would still be long enough without their first row
+        ok &= total[jc] - before - length < min_minutes
+        ks, stops, days = np.flatnonzero(ok), j[ok] + 1, day[ok]
+        # entries are built a block of spans at a time, so a limited search stops early
+        for b in range(0, len(ks), 64):
+            lo, hi = ks[b], stops[b:b + 64].max()
+            entries = self._entries(idx[lo:hi])
+            for k, stop, d in zip((ks[b:b + 64] - lo).tolist(), (stops[b:b + 64] - lo).tolist(),
+                                  days[b:b + 64].tolist()):
+                yield date.fromordinal(d), entries[k:stop]
@@ -0,0 +1,520 @@
+"""
+SQLite storage backend. SQLitePatientDB and SQLiteSchedule expose the same methods as
+PatientDB and ScheduleExcel, so the Orchestrator and app can run on either; the CSV/xlsx
+files become import/export formats (see SQLiteStore.import_* / export_*).
+"""
+
+import heapq
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date
+from itertools import groupby, islice
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from tools.patient_db import (PatientDB, NORM_COLS, DOB_WEIGHT, NAME_WEIGHT, _add_norm_columns, _clean_text,
+                              _name_grams, _norm_dob, _norm_fields, _norm_phone, _rank_candidates)
+from tools.schedule_excel import ScheduleExcel
+from tools.similarity import get_scorer
+from tools.slot_index import DEFAULT_LOCATION, _to_minutes, day_spans, find_span
+
+PATIENT_COLS = [
+    "patient_id","name","dob","gender","email","phone","address","city","state","zip",
+    "primary_insurer","member_id","group_no","preferred_doctor","is_returning","last_visit_date"
+]
+SLOT_COLS = ["date","start_time","end_time","slot_length","status","patient_id","notes","version","location"]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS patients (
+    seq INTEGER PRIMARY KEY,
+    {", ".join(f"{c} TEXT" for c in PATIENT_COLS + NORM_COLS)}
+);
+CREATE INDEX IF NOT EXISTS ix_patients_id ON patients(patient_id);
+CREATE INDEX IF NOT EXISTS ix_patients_email ON patients(email_norm);
+CREATE INDEX IF NOT EXISTS ix_patients_phone ON patients(phone_norm);
+CREATE INDEX IF NOT EXISTS ix_patients_dob ON patients(dob_norm);
+CREATE TABLE IF NOT EXISTS patient_grams (
+    gram TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (gram, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS slots (
+    id INTEGER PRIMARY KEY,
+    doctor TEXT NOT NULL,
+    date TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    start_min INTEGER NOT NULL,
+    end_min INTEGER NOT NULL,
+    slot_length INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    patient_id TEXT,
+    notes TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    location TEXT NOT NULL DEFAULT '{DEFAULT_LOCATION}'
+);
+CREATE INDEX IF NOT EXISTS ix_slots_free ON slots(doctor, status, date, start_min);
+CREATE INDEX IF NOT EXISTS ix_slots_day ON slots(status, date, start_min);
+CREATE TABLE IF NOT EXISTS slot_usage (
+    doctor TEXT NOT NULL,
+    date TEXT NOT NULL,
+    free_min INTEGER NOT NULL DEFAULT 0,
+    booked_min INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (doctor, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS appointments (
+    appt_id TEXT PRIMARY KEY,
+    patient_id TEXT,
+    doctor TEXT,
+    date TEXT,
+    created_at TEXT,
+    data TEXT NOT NULL,
+    export_pending INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS ix_appointments_created ON appointments(created_at);
+"""
+
+def _cell(v):
+    # NaN / NaT -> NULL, everything else as text
+    if v is None or (not isinstance(v, str) and pd.isna(v)):
+        return None
+    return str(v)
+
+def _time_text(t) -> str:
+    return t.strftime("%H:%M") if hasattr(t, "strftime") else str(t).strip()
+
+class SQLiteStore:
+    """One SQLite database (WAL mode) shared by the patient, schedule and appointment adapters."""
+    def __init__(self, db_path="data/scheduler.db"):
+        self.db_path = db_path
+        # autocommit mode; writes go through transaction() so they take the write lock up front
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=10000")
+        self.conn.executescript(SCHEMA)
+        # databases created before slots had a location
+        if "location" not in {r["name"] for r in self.conn.execute("PRAGMA table_info(slots)")}:
+            self.conn.execute(f"ALTER TABLE slots ADD COLUMN location TEXT NOT NULL DEFAULT '{DEFAULT_LOCATION}'")
+        # ... or before appointments remembered whether they changed since the last export
+        # (rows with an exported_at stamp were treated as exported, so keep that)
+        if "export_pending" not in {r["name"] for r in self.conn.execute("PRAGMA table_info(appointments)")}:
+            with self.transaction() as conn:
+                conn.execute("ALTER TABLE appointments ADD COLUMN export_pending INTEGER NOT NULL DEFAULT 1")
+                conn.execute("UPDATE appointments SET export_pending=0 "
+                             "WHERE COALESCE(json_extract(data, '$.exported_at'), '') != ''")
+        # ... or before the per-day usage aggregates
+        if not self.query("SELECT 1 FROM slot_usage LIMIT 1") and self.query("SELECT 1 FROM slots LIMIT 1"):
+            with self.transaction() as conn:
+                self.rebuild_usage(conn)
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT; rolled back if the block raises."""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def query(self, sql, params=()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def is_empty(self) -> bool:
+        return not self.query("SELECT 1 FROM patients LIMIT 1") and not self.query("SELECT 1 FROM slots LIMIT 1")
+
+    # ---- patients ----
+
+    def insert_patients(self, conn, rows: List[Dict]):
+        """Insert normalized patient rows (and their name trigrams) inside a transaction."""
+        cols = PATIENT_COLS + NORM_COLS
+        sql = f"INSERT INTO patients ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+        for row in rows:
+            cur = conn.execute(sql, [_cell(row.get(c)) for c in cols])
+            conn.executemany("INSERT OR IGNORE INTO patient_grams (gram, seq) VALUES (?, ?)",
+                             [(g, cur.lastrowid) for g in _name_grams(row.get("name_norm") or "")])
+
+    def import_patients_csv(self, csv_path):
+        df = pd.read_csv(csv_path, dtype=str)
+        for c in PATIENT_COLS:
+            if c not in df.columns:
+                df[c] = ""
+        _add_norm_columns(df)
+        with self.transaction() as conn:
+            self.insert_patients(conn, df.to_dict("records"))
+
+    def export_patients_csv(self, csv_path):
+        rows = self.query(f"SELECT {', '.join(PATIENT_COLS)} FROM patients ORDER BY seq")
+        pd.DataFrame([dict(r) for r in rows], columns=PATIENT_COLS).to_csv(csv_path, index=False)
+
+    # ---- slots ----
+
+    def import_schedules_xlsx(self, xlsx_path):
+        sheets = pd.read_excel(xlsx_path, sheet_name=None, parse_dates=["date"])
+        with self.transaction() as conn:
+            for doctor, df in sheets.items():
+                for r in df.to_dict("records"):
+                    if pd.isna(r.get("date")):
+                        continue
+                    start, end = _time_text(r["start_time"]), _time_text(r["end_time"])
+                    status = {"available": "Available", "booked": "Booked"}.get(str(r["status"]).lower(), str(r["status"]))
+                    version = r.get("version")
+                    version = 0 if version is None or pd.isna(version) else int(version)
+                    location = (_cell(r.get("location")) or DEFAULT_LOCATION).strip()
+                    conn.execute(
+                        "INSERT INTO slots (doctor, date, start_time, end_time, start_min, end_min, "
+                        "slot_length, status, patient_id, notes, version, location) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                        (doctor, r["date"].date().isoformat(), start, end, _to_minutes(start), _to_minutes(end),
+                         int(r["slot_length"]), status, _cell(r.get("patient_id")), _cell(r.get("notes")), version,
+                         location))
+            self.rebuild_usage(conn)
+
+    def rebuild_usage(self, conn):
+        """Recompute slot_usage (free / booked minutes per doctor and day) from the slots table."""
+        conn.execute("DELETE FROM slot_usage")
+        conn.execute(
+            "INSERT INTO slot_usage (doctor, date, free_min, booked_min) "
+            "SELECT doctor, date, SUM(CASE WHEN status='Available' THEN slot_length ELSE 0 END), "
+            "SUM(CASE WHEN status='Booked' THEN slot_length ELSE 0 END) FROM slots GROUP BY doctor, date")
+
+    @staticmethod
+    def move_usage(conn, doctor, day_iso, minutes):
+        """Move minutes from free to booked (negative: booked back to free) on one doctor-day."""
+        conn.execute("UPDATE slot_usage SET free_min=free_min-?, booked_min=booked_min+? WHERE doctor=? AND date=?",
+                     (minutes, minutes, doctor, day_iso))
+
+    def export_schedules_xlsx(self, xlsx_path):
+        with pd.ExcelWriter(xlsx_path, engine="openpyxl") as writer:
+            for doctor in [r["doctor"] for r in self.query("SELECT doctor FROM slots GROUP BY doctor ORDER BY MIN(id)")]:
+                rows = self.query(f"SELECT {', '.join(SLOT_COLS)} FROM slots WHERE doctor=? ORDER BY id", (doctor,))
+                df = pd.DataFrame([dict(r) for r in rows], columns=SLOT_COLS)
+                df["date"] = pd.to_datetime(df["date"])
+                df.to_excel(writer, sheet_name=doctor, index=False)
+
+    # ---- appointments ----
+
+    def insert_appointment(self, appt: Dict):
+        self.insert_appointments([appt])
+
+    def insert_appointments(self, appts: List[Dict]):
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO appointments (appt_id, patient_id, doctor, date, created_at, data) VALUES (?,?,?,?,?,?)",
+                [(appt["appt_id"], appt.get("patient_id"), appt.get("doctor"), appt.get("date"),
+                  appt.get("created_at"), json.dumps(appt, default=str)) for appt in appts])
+
+    def update_appointment(self, appt_id: str, track: bool = True, **fields):
+        """Set fields on one appointment; track=True also marks it pending for the next export."""
+        with self.transaction() as conn:
+            row = conn.execute("SELECT data FROM appointments WHERE appt_id=?", (appt_id,)).fetchone()
+            if row is None:
+                return
+            appt = {**json.loads(row["data"]), **fields}
+            conn.execute("UPDATE appointments SET data=?, export_pending=MAX(export_pending, ?) WHERE appt_id=?",
+                         (json.dumps(appt, default=str), int(track), appt_id))
+
+    def mark_exported(self, appt_ids: List[str], exported_at: str):
+        """Stamp exported_at on the given appointments and clear their pending flag, in one transaction."""
+        with self.transaction() as conn:
+            for appt_id in appt_ids:
+                row = conn.execute("SELECT data FROM appointments WHERE appt_id=?", (appt_id,)).fetchone()
+                if row is None:
+                    continue
+                appt = {**json.loads(row["data"]), "exported_at": exported_at}
+                conn.execute("UPDATE appointments SET data=?, export_pending=0 WHERE appt_id=?",
+                             (json.dumps(appt, default=str), appt_id))
+
+    def load_appointments(self) -> List[Dict]:
+        return [json.loads(r["data"]) for r in self.query("SELECT data FROM appointments ORDER BY created_at, rowid")]
+
+    def pending_exports(self) -> set:
+        """appt_ids created or changed since they were last exported."""
+        return {r["appt_id"] for r in self.query("SELECT appt_id FROM appointments WHERE export_pending")}
+
+class SQLitePatientDB:
+    """PatientDB API over SQLiteStore: indexed exact lookups, trigram-blocked fuzzy stage."""
+    # same record builder as the CSV registry
+    _new_patient_dict = PatientDB._new_patient_dict
+
+    def __init__(self, store: SQLiteStore, shortlist_size: int = 200, scorer="auto",
+                 name_weight: float = NAME_WEIGHT, dob_weight: float = DOB_WEIGHT):
+        self.store = store
+        self.shortlist_size = shortlist_size
+        self.scorer = get_scorer(scorer)
+        self.name_weight = name_weight
+        self.dob_weight = dob_weight
+
+    def _first(self, column: str, value) -> Optional[Dict]:
+        rows = self.store.query(
+            f"SELECT {', '.join(PATIENT_COLS + NORM_COLS)} FROM patients WHERE {column}=? ORDER BY seq LIMIT 1",
+            (value,))
+        return dict(rows[0]) if rows else None
+
+    def _candidates(self, name_q: str, dob_q: str) -> List[Tuple[int, str, str]]:
+        # DOB bucket plus the rows sharing the most name trigrams, in table order
+        grams = sorted(_name_grams(name_q))
+        seqs = set()
+        if grams:
+            rows = self.store.query(
+                f"SELECT seq FROM patient_grams WHERE gram IN ({', '.join('?' * len(grams))}) "
+                "GROUP BY seq ORDER BY COUNT(*) DESC, seq LIMIT ?", (*grams, self.shortlist_size))
+            seqs.update(r["seq"] for r in rows)
+        if dob_q:
+            seqs.update(r["seq"] for r in self.store.query("SELECT seq FROM patients WHERE dob_norm=?", (dob_q,)))
+        if not seqs:
+            return []
+        rows = self.store.query(
+            f"SELECT seq, name_norm, dob_norm FROM patients WHERE seq IN ({', '.join('?' * len(seqs))}) ORDER BY seq",
+            tuple(seqs))
+        return [(r["seq"], r["name_norm"] or "", r["dob_norm"] or "") for r in rows]
+
+    def match_patient(self, name: str, dob, phone: Optional[str]=None, email: Optional[str]=None,
+                      fuzzy_threshold: float = 0.65) -> Tuple[Dict, str, float]:
+        """Same contract as PatientDB.match_patient."""
+        name_q, dob_q = _clean_text(name or ""), _norm_dob(dob)
+        return self._match(name, dob, phone, email, fuzzy_threshold, lambda: self._ranking(name_q, dob_q))
+
+    def _match(self, name, dob, phone, email, fuzzy_threshold, ranking) -> Tuple[Dict, str, float]:
+        # ranking() is only called when neither email nor phone matches exactly
+        email_q = (email or "").strip().lower()
+        phone_q = _norm_phone(phone or "")
+        if email_q:
+            row = self._first("email_norm", email_q)
+            if row is not None:
+                return (row, "returning", 1.0)
+        if phone_q:
+            row = self._first("phone_norm", phone_q)
+            if row is not None:
+                return (row, "returning", 1.0)
+
+        best, best_score, _ = ranking()
+        if best is not None and best_score >= float(fuzzy_threshold):
+            return (self._first("seq", best), "returning", round(float(best_score), 3))
+        return (self._new_patient_dict(name, dob, phone, email), "new", 0.0)
+
+    def match_patients(self, records: List[Dict], fuzzy_threshold: float = 0.65) -> List[Tuple[Dict, str, float]]:
+        """Same contract as PatientDB.match_patients."""
+        return [self.match_patient(r.get("name"), r.get("dob"), r.get("phone"), r.get("email"), fuzzy_threshold)
+                for r in records]
+
+    def _ranking(self, name_q: str, dob_q: str, top_k: int = 10):
+        # not cached: other processes can add patients to the database at any time
+        return _rank_candidates(name_q, dob_q, self._candidates(name_q, dob_q), self.scorer,
+                                self.name_weight, self.dob_weight, top_k)
+
+    def _candidate_dicts(self, top, top_k):
+        out = []
+        for seq, name_score, combined in top[:top_k]:
+            row = self._first("seq", seq)
+            out.append({
+                "patient_id": row["patient_id"],
+                "name": row["name"],
+                "dob_norm": row["dob_norm"],
+                "name_score": round(name_score,3),
+                "combined": round(combined,3)
+            })
+        return out
+
+    def debug_candidates(self, name: str, dob, top_k:int=10):
+        """Return top candidates (from the blocked shortlist) with scores for inspection."""
+        name_q = _clean_text(name or "")
+        dob_q = _norm_dob(dob)
+        return self._candidate_dicts(self._ranking(name_q, dob_q, top_k)[2], top_k)
+
+    def match_with_candidates(self, name: str, dob, phone: Optional[str]=None, email: Optional[str]=None,
+                              top_k: int = 5, fuzzy_threshold: float = 0.65):
+        """Same contract as PatientDB.match_with_candidates."""
+        name_q, dob_q = _clean_text(name or ""), _norm_dob(dob)
+        ranked = self._ranking(name_q, dob_q, top_k)
+        patient, status, score = self._match(name, dob, phone, email, fuzzy_threshold, lambda: ranked)
+        return patient, status, score, self._candidate_dicts(ranked[2], top_k)
+
+    def create_patient(self, name, dob, phone, email, preferred_doctor):
+        return self.create_patients([{"name": name, "dob": dob, "phone": phone, "email": email,
+                                      "preferred_doctor": preferred_doctor}])[0]
+
+    def create_patients(self, records: List[Dict]) -> List[Dict]:
+        new_rows = [
+            self._new_patient_dict(r.get("name"), r.get("dob"), r.get("phone"), r.get("email"),
+                                   r.get("preferred_doctor"))
+            for r in records
+        ]
+        with self.store.transaction() as conn:
+            self.store.insert_patients(conn, [{**r, **_norm_fields(r)} for r in new_rows])
+        return new_rows
+
+    def get_patient(self, patient_id: str) -> Optional[Dict]:
+        return self._first("patient_id", patient_id)
+
+class SQLiteSchedule:
+    """ScheduleExcel API over SQLiteStore; slot claims are compare-and-swap UPDATEs in one transaction."""
+    upcoming_days = ScheduleExcel.upcoming_days
+
+    def __init__(self, store: SQLiteStore):
+        self.store = store
+        # the open batch() transaction, per thread: the instance is shared by every app
+        # session, and only the thread that opened the batch may book inside it
+        self._local = threading.local()
+
+    @property
+    def _batch_conn(self):
+        return getattr(self._local, "conn", None)
+
+    @staticmethod
+    def _entry(r) -> Tuple:
+        # same tuple layout as SlotIndex entries, so the span helpers apply unchanged
+        return (r["start_min"], r["end_min"], r["id"], r["start_time"], r["end_time"], r["slot_length"], r["version"])
+
+    def list_doctors(self):
+        return [r["doctor"] for r in self.store.query("SELECT doctor FROM slots GROUP BY doctor ORDER BY MIN(id)")]
+
+    def available_slots(self, doctor, target_date_iso):
+        target = pd.to_datetime(target_date_iso).date()
+        rows = self.store.query(
+            "SELECT * FROM slots WHERE doctor=? AND status='Available' AND date=? ORDER BY start_min",
+            (doctor, target.isoformat()))
+        return [ScheduleExcel._slot_dict(target, self._entry(r)) for r in rows]
+
+    def find_slots(self, doctor, required_minutes, from_date=None, limit=None, to_date=None):
+        """Same contract as ScheduleExcel.find_slots; rows are streamed day by day from the index."""
+        lo = pd.to_datetime(from_date).date().isoformat() if from_date is not None else ""
+        hi = pd.to_datetime(to_date).date().isoformat() if to_date is not None else "9999-12-31"
+        with self.store._lock:
+            cur = self.store.conn.execute(
+                "SELECT * FROM slots WHERE doctor=? AND status='Available' AND date>=? AND date<=? "
+                "ORDER BY date, start_min", (doctor, lo, hi))
+            def spans():
+                for d, rows in groupby(cur, key=lambda r: r["date"]):
+                    day = pd.to_datetime(d).date()
+                    for span in day_spans([self._entry(r) for r in rows], required_minutes):
+                        yield ScheduleExcel._span_dict(day, span)
+            return list(islice(spans(), limit))
+
+    def find_slots_any(self, required_minutes, from_date=None, limit=None, to_date=None,
+                       location=None, doctors=None):
+        """Same contract as ScheduleExcel.find_slots_any: one date-ordered scan over all
+        doctors, each day's spans merged across doctors with a k-way heap."""
+        lo = pd.to_datetime(from_date).date().isoformat() if from_date is not None else ""
+        hi = pd.to_datetime(to_date).date().isoformat() if to_date is not None else "9999-12-31"
+        rank = {doc: i for i, doc in enumerate(self.list_doctors() if doctors is None else doctors)}
+        sql = "SELECT * FROM slots WHERE status='Available' AND date>=? AND date<=?"
+        params = [lo, hi]
+        if location is not None:
+            sql += " AND location=?"
+            params.append(location)
+        with self.store._lock:
+            cur = self.store.conn.execute(sql + " ORDER BY date, doctor, start_min", params)
+            def spans():
+                for d, rows in groupby(cur, key=lambda r: r["date"]):
+                    day = pd.to_datetime(d).date()
+                    per_doctor = []
+                    for doctor, doc_rows in groupby(rows, key=lambda r: r["doctor"]):
+                        if doctor not in rank:
+                            continue
+                        doc_rows = list(doc_rows)
+                        sites = {r["id"]: r["location"] for r in doc_rows}
+                        per_doctor.append([
+                            (span[0][0], rank[doctor], doctor, sites[span[0][2]], span)
+                            for span in day_spans([self._entry(r) for r in doc_rows], required_minutes)])
+                    # (start, doctor rank) keys: earliest first, ties to the doctor listed first
+                    for _, _, doctor, site, span in heapq.merge(*per_doctor, key=lambda item: item[:2]):
+                        slot = ScheduleExcel._span_dict(day, span)
+                        slot["doctor"] = doctor
+                        slot["location"] = site
+                        yield slot
+            return list(islice(spans(), limit))
+
+    def list_locations(self):
+        return [r["location"] for r in self.store.query("SELECT location FROM slots GROUP BY location ORDER BY MIN(id)")]
+
+    def _claim(self, conn, doctor, slot, patient_id):
+        d = pd.to_datetime(slot["date"]).date().isoformat()
+        rows = conn.execute(
+            "SELECT * FROM slots WHERE doctor=? AND status='Available' AND date=? ORDER BY start_min",
+            (doctor, d)).fetchall()
+        span = find_span([self._entry(r) for r in rows], slot["start_time"], slot["end_time"])
+        if span is None:
+            return False
+        if slot.get("version") is not None and sum(e[6] for e in span) != slot["version"]:
+            return False
+        for e in span:
+            cur = conn.execute(
+                "UPDATE slots SET status='Booked', version=version+1, patient_id=COALESCE(?, patient_id) "
+                "WHERE id=? AND status='Available' AND version=?", (patient_id, e[2], e[6]))
+            if cur.rowcount != 1:
+                raise sqlite3.IntegrityError("slot changed during claim")
+        SQLiteStore.move_usage(conn, doctor, d, sum(e[5] for e in span))
+        return True
+
+    def book_slot(self, doctor, slot, patient_id=None):
+        """Claim the free row(s) covering the slot in one transaction. Return True/False."""
+        if self._batch_conn is not None:
+            return self._claim(self._batch_conn, doctor, slot, patient_id)
+        try:
+            with self.store.transaction() as conn:
+                return self._claim(conn, doctor, slot, patient_id)
+        except sqlite3.IntegrityError:
+            return False
+
+    def _release(self, conn, doctor, slot, patient_id):
+        d = pd.to_datetime(slot["date"]).date().isoformat()
+        rows = conn.execute(
+            "SELECT * FROM slots WHERE doctor=? AND status='Booked' AND date=? ORDER BY start_min",
+            (doctor, d)).fetchall()
+        span = find_span([self._entry(r) for r in rows], slot["start_time"], slot["end_time"])
+        if span is None:
+            return False
+        if patient_id is not None:
+            owners = {r["id"]: r["patient_id"] for r in rows}
+            if any(str(owners[e[2]]) != str(patient_id) for e in span):
+                return False
+        for e in span:
+            conn.execute("UPDATE slots SET status='Available', version=version+1, patient_id=NULL WHERE id=?",
+                         (e[2],))
+        SQLiteStore.move_usage(conn, doctor, d, -sum(e[5] for e in span))
+        return True
+
+    def release_slot(self, doctor, slot, patient_id=None):
+        """Same contract as ScheduleExcel.release_slot, in one transaction."""
+        if self._batch_conn is not None:
+            return self._release(self._batch_conn, doctor, slot, patient_id)
+        with self.store.transaction() as conn:
+            return self._release(conn, doctor, slot, patient_id)
+
+    def utilization(self, from_date=None, to_date=None, doctors=None):
+        """Same contract as ScheduleExcel.utilization, read from the slot_usage table."""
+        lo = pd.to_datetime(from_date).date().isoformat() if from_date is not None else ""
+        hi = pd.to_datetime(to_date).date().isoformat() if to_date is not None else "9999-12-31"
+        rank = {doc: i for i, doc in enumerate(self.list_doctors() if doctors is None else doctors)}
+        rows = self.store.query("SELECT * FROM slot_usage WHERE date>=? AND date<=?", (lo, hi))
+        rows = sorted((r for r in rows if r["doctor"] in rank), key=lambda r: (rank[r["doctor"]], r["date"]))
+        usage = pd.DataFrame([(r["doctor"], date.fromisoformat(r["date"]), r["free_min"], r["booked_min"]) for r in rows],
+                             columns=["doctor", "date", "free_minutes", "booked_minutes"])
+        return ScheduleExcel._with_utilization(usage)
+
+    @contextmanager
+    def batch(self):
+        """Run many book_slot calls in a single transaction."""
+        if self._batch_conn is not None:
+            # nested: already inside this thread's batch
+            yield self
+            return
+        with self.store.transaction() as conn:
+            self._local.conn = conn
+            try:
+                yield self
+            finally:
+                self._local.conn = None
+
+    def flush(self):
+        # every claim is committed by its transaction
+        pass